@@ -1,24 +1,229 @@
 import os
-from flask import Flask, request, abort, jsonify, redirect, session
+import hashlib
+import json
+from flask import (Flask, current_app, request, abort, jsonify, redirect,
+                   session, Response, stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import func, distinct
+from sqlalchemy.exc import IntegrityError
 from flask_cors import CORS
-import json
-from auth import requires_auth, AuthError
-from models import setup_db, database_path, Tree, Farmer, Forest, db
-from authlib.integrations.flask_client import OAuth
+from auth import requires_auth, AuthError, token_cache
+from cache import ResponseCache
+from metrics import Metrics, Value
+from routing import ReplicaRouter
+from imports import (IMPORT_FORMATS, InvalidRow, detect_format, queue_import,
+                     fail_stale_imports, required, coordinates)
+from geo import GeoIndex, distance_km
+from serialization import dumps, json_response, init_app as init_json
+from models import (setup_db, database_path, Tree, Farmer, Forest, Counter,
+                    TreeStat, Planting, Import, IdempotencyKey,
+                    forest_trees_key, farmer_trees_key, db, species_cache,
+                    TREE_STORAGE, TREE_STORAGES, MAX_PLANTING_QUANTITY)
 from six.moves.urllib.parse import urlencode
 from dotenv import load_dotenv, find_dotenv
 from werkzeug.exceptions import HTTPException
 
+TREES_PER_PAGE = 100
+MAX_TREES_PER_PAGE = 1000
+STREAM_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 1000
+# trees written per request, a planting is a single row of any quantity
+MAX_QUANTITY = 10000
+MAX_NEAREST_FORESTS = 100
+
+
+def stream_ndjson(query, to_dict=lambda row: row._asdict()):
+    # streams the rows of a column query as newline delimited json, fetching
+    # them through a server-side cursor so memory stays flat
+    def generate():
+        lines = []
+        for row in query.yield_per(STREAM_BATCH_SIZE):
+            lines.append(dumps(to_dict(row)))
+            if len(lines) == STREAM_BATCH_SIZE:
+                yield b'\n'.join(lines) + b'\n'
+                lines = []
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+def wants_ndjson():
+    return request.args.get('format', None) == 'ndjson'
+
+
+def is_int(value):
+    # json booleans are ints in python, they are not accepted as ids
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def id_ranges(ids):
+    # the contiguous runs of the ids as [first, last] pairs. The ids of
+    # concurrent inserts interleave, so a run ends where another client's
+    # trees start
+    ranges = []
+    for id in ids:
+        if ranges and ranges[-1][1] + 1 == id:
+            ranges[-1][1] = id
+        else:
+            ranges.append([id, id])
+    return ranges
+
+
+def model_columns(model):
+    return [getattr(model, field) for field in model.fields]
+
+
+def int_arg(key, default):
+    # an argument that does not parse is rejected rather than replaced by
+    # the default
+    if key not in request.args:
+        return default
+    value = request.args.get(key, None, type=int)
+    if value is None:
+        abort(400)
+    return value
+
+
+def tree_page_args():
+    # ?after=<id>&limit=N&fields=a,b, shared by the endpoints listing trees
+    after = int_arg('after', 0)
+    limit = int_arg('limit', TREES_PER_PAGE)
+    if limit < 1:
+        abort(400)
+    limit = min(limit, MAX_TREES_PER_PAGE)
+
+    fields = request.args.get('fields', None)
+    try:
+        columns = Tree.columns(fields.split(',') if fields else None)
+    except ValueError as e:
+        current_app.logger.info(e)
+        abort(400)
+    return columns, after, limit
+
+
+def parse_farmer(item):
+    return {'name': required(item, 'name')}
+
+
+def parse_forest(item):
+    return {'name': required(item, 'name'),
+            'location': required(item, 'location'),
+            **coordinates(item)}
+
+
+def forests_by_id(ids):
+    # the forest rows of the ids, in the order of the ids
+    rows = {row.id: row._asdict() for row in db.session.query(
+        *model_columns(Forest)).filter(Forest.id.in_(ids))} if ids else {}
+    return [rows[id] for id in ids if id in rows]
+
+
+def geo_args(*names):
+    # the float query parameters, 400 when one is missing or out of range
+    values = []
+    for name in names:
+        value = request.args.get(name, None, type=float)
+        bound = 90 if name.endswith('lat') else 180
+        if value is None or not -bound <= value <= bound:
+            abort(400)
+        values.append(value)
+    return values
+
+
+def replay(stored, request_hash):
+    # a key reused for another request is refused rather than replayed
+    if stored.request_hash != request_hash:
+        abort(422)
+    return json_response(json.loads(stored.response))
+
+
+def create_batch(model, plural, parse):
+    '''Inserts the valid items of the request in one transaction, reports
+    the invalid ones by index'''
+    body = request.get_json(silent=True)
+    items = body.get(plural) if isinstance(body, dict) else None
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_BATCH_SIZE:
+        abort(422)
+
+    key = request.headers.get('Idempotency-Key')
+    if key is not None and not 0 < len(key) <= 255:
+        abort(400)
+    request_hash = hashlib.sha256(
+        json.dumps(items, sort_keys=True).encode()).hexdigest()
+    if key is not None:
+        stored = IdempotencyKey.find(request.path, key)
+        if stored is not None:
+            return replay(stored, request_hash)
+
+    rows, indexes, failed = [], [], []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise InvalidRow('invalid item')
+            rows.append(parse(item))
+            indexes.append(index)
+        except InvalidRow as e:
+            failed.append({'index': index, 'error': str(e)})
+
+    try:
+        ids = model.insert_many(rows)
+        response = {
+            'success': True,
+            'created': [dict(row, id=id, index=index)
+                        for row, id, index in zip(rows, ids, indexes)],
+            'failed': failed,
+            f'total_{plural}': Counter.get(plural)
+        }
+        if key is not None:
+            IdempotencyKey.add(request.path, key, request_hash, response)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        # a concurrent retry with the same key committed first
+        stored = IdempotencyKey.find(request.path, key) \
+            if key is not None else None
+        if stored is None:
+            raise
+        return replay(stored, request_hash)
+    except BaseException:
+        db.session.rollback()
+        raise
+    return json_response(response)
+
+
+def includes():
+    # ?include=trees adds the related rows to a detail endpoint
+    include = request.args.get('include', None)
+    include = set(include.split(',')) if include else set()
+    if include - {'trees'}:
+        abort(400)
+    return include
+
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    oauth = OAuth(app)
     CORS(app)
+    init_json(app)
+    ReplicaRouter.from_config(test_config or {}).init_app(app)
+    metrics = Metrics()
+    for name, metric, type in (('hits', 'hits_total', 'counter'),
+                               ('misses', 'misses_total', 'counter'),
+                               ('size', 'size', 'gauge')):
+        metrics.add(Value(
+            f'jwt_token_cache_{metric}', f'Verified token cache {name}', type,
+            lambda name=name: token_cache.stats()[name]))
+    metrics.init_app(app)
     setup_db(app, database_path)
     app.secret_key = os.environ.get("SECRET_KEY")
+    app.config['TREE_STORAGE'] = (test_config or {}).get(
+        'TREE_STORAGE', TREE_STORAGE)
+    if app.config['TREE_STORAGE'] not in TREE_STORAGES:
+        raise ValueError(
+            f'Unknown tree storage: {app.config["TREE_STORAGE"]}')
+    response_cache = ResponseCache.from_config(test_config or {})
+    geo_index = GeoIndex.from_config(test_config or {})
 
     @app.after_request
     def after_request(response):
@@ -29,23 +234,29 @@ def create_app(test_config=None):
 
         return response
 
-    auth0 = oauth.register(
-        'auth0',
-        client_id='oKWhbpnbNRWsmcY52NgNmbTSTnEyr7vA',
-        client_secret=os.environ.get("CLIENT_SECRET"),
-        api_base_url='https://tree-app.eu.auth0.com',
-        access_token_url='https://tree-app.eu.auth0.com/oauth/token',
-        authorize_url='https://tree-app.eu.auth0.com/authorize',
-        client_kwargs={
-            'scope': 'openid profile email',
-        },
-    )
+    def auth0():
+        # the Auth0 client is built by the first login, the API requests
+        # never need it
+        if 'auth0' not in app.extensions:
+            from authlib.integrations.flask_client import OAuth
+            app.extensions['auth0'] = OAuth(app).register(
+                'auth0',
+                client_id='oKWhbpnbNRWsmcY52NgNmbTSTnEyr7vA',
+                client_secret=os.environ.get("CLIENT_SECRET"),
+                api_base_url='https://tree-app.eu.auth0.com',
+                access_token_url='https://tree-app.eu.auth0.com/oauth/token',
+                authorize_url='https://tree-app.eu.auth0.com/authorize',
+                client_kwargs={
+                    'scope': 'openid profile email',
+                },
+            )
+        return app.extensions['auth0']
 
     @app.route('/callback')
     def callback_handling():
         # Handles response from token endpoint
-        auth0.authorize_access_token()
-        resp = auth0.get('userinfo')
+        auth0().authorize_access_token()
+        resp = auth0().get('userinfo')
         userinfo = resp.json()
 
         # Store the user information in flask session.
@@ -59,7 +270,7 @@ def create_app(test_config=None):
 
     @app.route('/login')
     def login():
-        return auth0.authorize_redirect(
+        return auth0().authorize_redirect(
             redirect_uri='https://tree-app-udacity.herokuapp.com/')
 
     # HOMEPAGE
@@ -70,19 +281,77 @@ def create_app(test_config=None):
     # GET TREES
 
     @app.route('/trees', methods=['GET'])
+    @response_cache.cached('trees')
     def get_trees():
-        trees = [tree.format() for tree in Tree.query.all()]
-        return jsonify({
+        # keyset pagination on the tree id, ?after=<id>&limit=N
+        columns, after, limit = tree_page_args()
+
+        # ndjson exports every tree after the cursor, without a page limit
+        if wants_ndjson():
+            return stream_ndjson(db.session.query(*columns).filter(
+                Tree.id > after, Tree.live).order_by(Tree.id), Tree.to_dict)
+
+        trees, next_cursor = Tree.page(columns, after=after, limit=limit)
+
+        return json_response({
             'success': True,
             'trees': trees,
-            "number_of_trees": len(trees)
+            "number_of_trees": len(trees),
+            'next_cursor': next_cursor
         })
 
     # GET FORESTS
     @app.route('/forests', methods=['GET'])
+    @response_cache.cached('forests')
     def get_forests():
-        forests = [forest.format() for forest in Forest.query.all()]
-        return jsonify({
+        query = db.session.query(*model_columns(Forest)).order_by(Forest.id)
+        if wants_ndjson():
+            return stream_ndjson(query)
+
+        # the rows are serialized from the selected columns, without loading
+        # model instances
+        forests = [row._asdict() for row in query]
+        return json_response({
+            'success': True,
+            'forests': forests,
+            'number_of_forests': len(forests)
+        })
+
+    # SEARCH FORESTS IN A BOUNDING BOX
+    @app.route('/forests/search', methods=['GET'])
+    @response_cache.cached('forests')
+    def search_forests():
+        # ?min_lat=&min_lon=&max_lat=&max_lon=, the box does not cross the
+        # antimeridian
+        min_lat, min_lon, max_lat, max_lon = geo_args(
+            'min_lat', 'min_lon', 'max_lat', 'max_lon')
+        limit = request.args.get('limit', TREES_PER_PAGE, type=int)
+        if min_lat > max_lat or min_lon > max_lon or limit < 1:
+            abort(400)
+
+        forests = forests_by_id(geo_index.bbox(
+            min_lat, min_lon, max_lat, max_lon,
+            min(limit, MAX_TREES_PER_PAGE)))
+        return json_response({
+            'success': True,
+            'forests': forests,
+            'number_of_forests': len(forests)
+        })
+
+    # NEAREST FORESTS
+    @app.route('/forests/nearest', methods=['GET'])
+    @response_cache.cached('forests')
+    def nearest_forests():
+        lat, lon = geo_args('lat', 'lon')
+        k = request.args.get('k', 10, type=int)
+        if not 0 < k <= MAX_NEAREST_FORESTS:
+            abort(400)
+
+        forests = forests_by_id(geo_index.nearest(lat, lon, k))
+        for forest in forests:
+            forest['distance_km'] = round(distance_km(
+                lat, lon, forest['latitude'], forest['longitude']), 3)
+        return json_response({
             'success': True,
             'forests': forests,
             'number_of_forests': len(forests)
@@ -90,9 +359,14 @@ def create_app(test_config=None):
 
     # GET FARMERS
     @app.route('/farmers', methods=['GET'])
+    @response_cache.cached('farmers')
     def get_farmers():
-        farmers = [farmer.format() for farmer in Farmer.query.all()]
-        return jsonify({
+        query = db.session.query(*model_columns(Farmer)).order_by(Farmer.id)
+        if wants_ndjson():
+            return stream_ndjson(query)
+
+        farmers = [row._asdict() for row in query]
+        return json_response({
             'success': True,
             'farmers': farmers,
             'number_of_farmers': len(farmers)
@@ -100,64 +374,142 @@ def create_app(test_config=None):
 
     # GET ONE FARMER
     @app.route('/farmers/<int:id>', methods=['GET'])
+    @response_cache.cached('farmers', 'trees')
     def get_farmer_id(id):
+        include = includes()
         farmer = Farmer.query.filter(Farmer.id == id).one_or_none()
         if farmer is None:
             abort(404)
 
-        # Getting tree count by type for selected farmer
-        farmer_trees_by_type_query = db.session.query(
-            Tree.name,
-            func.count(
-                Tree.id).label('count')).filter(
-            Tree.farmer_id == id).group_by(
-                Tree.name)
-        tree_count_by_type = {
-            row.name: row.count for row in farmer_trees_by_type_query}
+        # Getting tree count by type for selected farmer from the
+        # per forest statistics
+        tree_count_by_type = {}
+        for forest_id, name, count in TreeStat.by_farmer(id):
+            name = name or None
+            tree_count_by_type[name] = tree_count_by_type.get(name, 0) + count
 
-        return jsonify({
+        body = {
             'success': True,
             'farmer': farmer.format(),
             'trees': tree_count_by_type,
-            'number_of_trees': len(farmer.get_trees())
-        })
+            'number_of_trees': Counter.get(farmer_trees_key(id))
+        }
+        if 'trees' in include:
+            # one page of the farmer's trees, in a single projected query
+            columns, after, limit = tree_page_args()
+            body['tree_list'], body['next_cursor'] = Tree.page(
+                columns, Tree.farmer_id == id, after=after, limit=limit)
+        return json_response(body)
 
     # GET ONE FOREST
     @app.route('/forests/<int:id>', methods=['GET'])
+    @response_cache.cached('forests', 'trees')
     def get_forest_id(id):
+        include = includes()
         forest = Forest.query.filter(Forest.id == id).one_or_none()
         if forest is None:
             abort(404)
 
-        # Getting tree count by type for selected forest
-        forest_trees_by_type_query = db.session.query(
-            Tree.name,
-            func.count(
-                Tree.id).label('count')).filter(
-            Tree.forest_id == id).group_by(
-                Tree.name)
-        tree_count_by_type = {
-            row.name: row.count for row in forest_trees_by_type_query}
-
-        # Getting number of farmers for selected forest
-        farmer_count_query = db.session.query(
-            func.count(
-                distinct(
-                    Tree.farmer_id))).filter(
-            Tree.forest_id == id)
-        # try/except block to get the count of unique farmers - better way to
-        # do this??
-        try:
-            farmer_count = farmer_count_query[0][0]
-        except BaseException:
-            farmer_count = 0
-
-        return jsonify({
+        # Getting tree count by type and number of farmers for selected
+        # forest from the per farmer statistics
+        tree_count_by_type = {}
+        farmers = set()
+        for farmer_id, name, count in TreeStat.by_forest(id):
+            name = name or None
+            tree_count_by_type[name] = tree_count_by_type.get(name, 0) + count
+            if farmer_id:
+                farmers.add(farmer_id)
+        farmer_count = len(farmers)
+
+        body = {
             'success': True,
             'forest': forest.format(),
             'trees': tree_count_by_type,
-            'number_of_trees': len(forest.get_trees()),
+            'number_of_trees': Counter.get(forest_trees_key(id)),
             'farmer_count': farmer_count
+        }
+        if 'trees' in include:
+            columns, after, limit = tree_page_args()
+            body['tree_list'], body['next_cursor'] = Tree.page(
+                columns, Tree.forest_id == id, after=after, limit=limit)
+        return json_response(body)
+
+    # GET TREE STATISTICS
+    @app.route('/stats/trees', methods=['GET'])
+    @response_cache.cached('trees', 'forests')
+    def get_tree_stats():
+        group_by = request.args.get('group_by', None)
+        group_by = group_by.split(',') if group_by else []
+
+        # a filter or limit that does not parse is rejected rather than
+        # ignored
+        filters = {}
+        for key, kind in (('name', str), ('location', str),
+                          ('forest_id', int), ('farmer_id', int)):
+            if key in request.args:
+                filters[key] = request.args.get(key, None, type=kind)
+                if filters[key] is None:
+                    abort(400)
+
+        limit = request.args.get('limit', None, type=int)
+        order = request.args.get('order', 'desc')
+        if ('limit' in request.args and (limit is None or limit < 1)) or \
+                order not in ('asc', 'desc'):
+            abort(400)
+
+        try:
+            stats = TreeStat.aggregate(group_by, filters, limit,
+                                       descending=order == 'desc')
+        except ValueError as e:
+            app.logger.info(e)
+            abort(400)
+
+        return json_response({
+            'success': True,
+            'group_by': group_by,
+            'stats': stats,
+            'number_of_groups': len(stats)
+        })
+
+    # GET PLANTINGS
+    @app.route('/plantings', methods=['GET'])
+    @response_cache.cached('trees')
+    def get_plantings():
+        # keyset pagination on the planting id, like the trees
+        after = int_arg('after', 0)
+        limit = int_arg('limit', TREES_PER_PAGE)
+        if limit < 1:
+            abort(400)
+        # a filter that does not parse is rejected rather than ignored
+        criteria = []
+        for key in ('farmer_id', 'forest_id'):
+            if key in request.args:
+                value = request.args.get(key, None, type=int)
+                if value is None:
+                    abort(400)
+                criteria.append(getattr(Planting, key) == value)
+
+        plantings, next_cursor = Planting.page(
+            *criteria, after=after, limit=min(limit, MAX_TREES_PER_PAGE))
+
+        return json_response({
+            'success': True,
+            'plantings': plantings,
+            'number_of_plantings': len(plantings),
+            'next_cursor': next_cursor
+        })
+
+    # GET ONE PLANTING
+    @app.route('/plantings/<int:id>', methods=['GET'])
+    @response_cache.cached('trees')
+    def get_planting_id(id):
+        planting = Planting.query.filter(Planting.id == id).one_or_none()
+        if planting is None:
+            abort(404)
+
+        return json_response({
+            'success': True,
+            'planting': planting.format()
         })
 
     # CREATE FARMER
@@ -175,13 +527,19 @@ def create_app(test_config=None):
             return jsonify({
                 "success": True,
                 "created": farmer.format(),
-                "total_farmers": len(Farmer.query.all())
+                "total_farmers": Counter.get('farmers')
             })
 
         except Exception as e:
-            print(e)
+            app.logger.exception(e)
             abort(422)
 
+    # CREATE FARMERS IN BATCH
+    @app.route('/farmers/batch', methods=['POST'])
+    @requires_auth('post:farmer')
+    def create_farmers(payload):
+        return create_batch(Farmer, 'farmers', parse_farmer)
+
     # EDIT FARMER
     @app.route('/farmers/<int:id>', methods=['PATCH'])
     @requires_auth('patch:farmer')
@@ -204,8 +562,10 @@ def create_app(test_config=None):
                 "modified": farmer.format()
             })
 
+        except HTTPException:
+            raise
         except Exception as e:
-            print(e)
+            app.logger.exception(e)
             abort(422)
 
     # CREATE FOREST
@@ -217,20 +577,30 @@ def create_app(test_config=None):
             name = body.get('name', None)
             location = body.get('location', None)
 
-            forest = Forest(name=name, location=location)
+            forest = Forest(name=name, location=location,
+                            **coordinates(body))
 
             forest.insert()
 
             return jsonify({
                 "success": True,
                 "created": forest.format(),
-                "forests": [forest.format() for forest in Forest.query.all()]
+                "total_forests": Counter.get('forests')
             })
 
+        except InvalidRow as e:
+            app.logger.info(e)
+            abort(422)
         except Exception as e:
-            print(e)
+            app.logger.exception(e)
             abort(422)
 
+    # CREATE FORESTS IN BATCH
+    @app.route('/forests/batch', methods=['POST'])
+    @requires_auth('post:forest')
+    def create_forests(payload):
+        return create_batch(Forest, 'forests', parse_forest)
+
     # CREATE TREE
     @app.route('/trees', methods=['POST'])
     @requires_auth('post:tree')
@@ -242,60 +612,220 @@ def create_app(test_config=None):
             forest_id = body.get('forest_id', None)
             quantity = body.get('quantity')
 
-            # this is not working properly
-            if Farmer.query.filter(id == farmer_id).one_or_none is None:
-                print(f'Farmer with id {farmer_id} does not exist')
-                abort(404)
-
-            if Forest.query.filter(id == forest_id).one_or_none is None:
-                print(f'Forest with id {forest_id} does not exist')
+            if not isinstance(name, str) or not name.strip():
+                abort(422)
+
+            if not isinstance(quantity, int) or \
+                    isinstance(quantity, bool) or quantity < 1:
+                abort(422)
+            if quantity > (MAX_PLANTING_QUANTITY
+                           if app.config['TREE_STORAGE'] == 'plantings'
+                           else MAX_QUANTITY):
+                abort(422)
+
+            if not is_int(farmer_id) or not is_int(forest_id):
+                abort(422)
+
+            # both ids are checked before any tree is written
+            missing = Tree.missing_references(farmer_id, forest_id)
+            if missing:
+                app.logger.warning(
+                    f'Unknown {" and ".join(missing)}: farmer_id '
+                    f'{farmer_id}, forest_id {forest_id}')
                 abort(404)
 
-            trees = []
-            for i in range(quantity):
-                tree = Tree(
-                    name=name,
-                    farmer_id=farmer_id,
-                    forest_id=forest_id)
-                trees.append(tree)
-
-            for tree in trees:
-                tree.insert()
+            # the plantings storage records a single row for the quantity
+            if app.config['TREE_STORAGE'] == 'plantings':
+                planting = Planting.plant(name, farmer_id, forest_id,
+                                          quantity)
+                return jsonify({
+                    "success": True,
+                    "planting": planting.format(),
+                    "total_trees": Counter.get('trees')
+                })
+
+            ids = Tree.plant(name, farmer_id, forest_id, quantity)
+
+            # ?return=range answers with the runs of the created ids
+            # instead of one object per planted tree
+            if request.args.get('return', None) == 'range':
+                created = {
+                    'ranges': id_ranges(ids),
+                    'quantity': len(ids)
+                }
+            else:
+                created = [{
+                    'id': tree_id,
+                    'name': name,
+                    'farmer_id': farmer_id,
+                    'forest_id': forest_id
+                } for tree_id in ids]
 
             return jsonify({
                 "success": True,
-                "created": [tree.format() for tree in trees],
-                "total_trees": len([tree for tree in Tree.query.all()])
+                "created": created,
+                "total_trees": Counter.get('trees')
             })
 
+        except HTTPException:
+            raise
+        except Exception as e:
+            app.logger.exception(e)
+            abort(422)
+
+    # MATERIALIZE THE TREES OF A PLANTING
+    @app.route('/plantings/<int:id>/trees', methods=['POST'])
+    @requires_auth('post:tree')
+    def materialize_planting(payload, id):
+        body = request.get_json(silent=True) or {}
+        # at most MAX_QUANTITY trees are written per request
+        quantity = body.get('quantity', MAX_QUANTITY)
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or \
+                not 1 <= quantity <= MAX_QUANTITY:
+            abort(422)
+
+        # the row is locked so concurrent requests do not materialize the
+        # same trees twice
+        planting = Planting.query.filter(
+            Planting.id == id).with_for_update().one_or_none()
+        if planting is None:
+            abort(404)
+        try:
+            ids = planting.materialize(quantity)
         except Exception as e:
-            print(e)
+            app.logger.exception(e)
             abort(422)
 
+        return jsonify({
+            "success": True,
+            "created": {
+                'ranges': id_ranges(ids),
+                'quantity': len(ids)
+            },
+            "planting": planting.format()
+        })
+
     # DELETE TREE
 
     @app.route('/trees/<int:id>', methods=['DELETE'])
     @requires_auth('delete:tree')
     def delete_tree(payload, id):
         try:
-            tree = Tree.query.filter(Tree.id == id).one_or_none()
-            if tree is None:
+            # a conditional update, a tree deleted by a concurrent request
+            # is not found rather than uncounted twice
+            if not Tree.delete_many(Tree.id == id):
                 abort(404)
-            tree.delete()
 
             return jsonify({
                 "success": True,
                 "deleted": id,
-                "total_trees": len(Tree.query.all())
+                "total_trees": Counter.get('trees')
             })
 
+        except HTTPException:
+            raise
         except Exception as e:
-            print(e)
-            if tree is None:
-                abort(404)
+            app.logger.exception(e)
+            abort(422)
+
+    # DELETE TREES IN BULK
+    @app.route('/trees', methods=['DELETE'])
+    @requires_auth('delete:tree')
+    def delete_trees(payload):
+        # either {"ids": [...]} or a filter on farmer_id, forest_id and name.
+        # Only tree rows are deleted, the trees of the plantings that were
+        # not materialized are kept
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            abort(400)
+        ids = body.get('ids', None)
+        filters = {key: body[key] for key in ('farmer_id', 'forest_id', 'name')
+                   if key in body}
+        if ids is not None:
+            if filters or not isinstance(ids, list) or not ids or \
+                    len(ids) > MAX_BATCH_SIZE or \
+                    not all(is_int(id) for id in ids):
+                abort(422)
+            criteria = [Tree.id.in_(ids)]
+        elif filters:
+            criteria = []
+            for key, value in filters.items():
+                if key == 'name':
+                    if not isinstance(value, str):
+                        abort(422)
+                    # an unknown species matches no tree
+                    criteria.append(
+                        Tree.species_id == (species_cache.id(value) or -1))
+                elif not is_int(value):
+                    abort(422)
+                else:
+                    criteria.append(getattr(Tree, key) == value)
+        else:
             abort(422)
 
+        try:
+            deleted = Tree.delete_many(*criteria)
+        except Exception as e:
+            app.logger.exception(e)
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            "deleted": deleted,
+            "total_trees": Counter.get('trees')
+        })
+
+    # IMPORT FARMERS, FORESTS AND TREES
+    @app.route('/imports', methods=['POST'])
+    @requires_auth('post:import')
+    def create_import(payload):
+        # the file is either a multipart upload or the raw request body
+        upload = request.files.get('file')
+        if upload is not None:
+            stream = upload.stream
+            file_format = detect_format(upload.filename, upload.mimetype)
+        else:
+            stream = request.stream
+            file_format = detect_format(None, request.mimetype)
+        file_format = request.args.get('format', file_format)
+        if file_format not in IMPORT_FORMATS:
+            abort(400)
+
+        try:
+            job = queue_import(stream, file_format)
+        except Exception as e:
+            app.logger.exception(e)
+            abort(422)
+
+        return jsonify({
+            "success": True,
+            "import": job.format()
+        }), 202, {'Location': f'/imports/{job.id}'}
+
+    # GET IMPORT PROGRESS
+    @app.route('/imports/<int:id>', methods=['GET'])
+    @requires_auth('post:import')
+    def get_import(payload, id):
+        # the imports lost with the worker running them are reported failed
+        fail_stale_imports()
+        job = Import.query.filter(Import.id == id).one_or_none()
+        if job is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'import': job.format()
+        })
+
     # Error Handling
+    @app.errorhandler(400)
+    def bad_request(error):
+        return jsonify({
+            "success": False,
+            "error": 400,
+            "message": "bad request"
+        }), 400
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
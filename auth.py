@@ -1,13 +1,33 @@
 import json
+import hashlib
+from collections import OrderedDict
 from flask import request, _request_ctx_stack, abort
 from functools import wraps
-from jose import jwt
 from urllib.request import urlopen
+import logging
 import os
+import threading
+import time
 
-AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
-ALGORITHMS = os.environ['AUTH0_ALGORITHMS']
-API_AUDIENCE = os.environ['API_AUDIENCE']
+from metrics import observe_jwt_verify
+
+# a missing variable only fails the requests that verify a token, so the
+# app can start, and be imported by the tools, without them
+AUTH0_DOMAIN = os.environ.get('AUTH0_DOMAIN')
+ALGORITHMS = os.environ.get('AUTH0_ALGORITHMS')
+API_AUDIENCE = os.environ.get('API_AUDIENCE')
+
+# the signing keys are fetched from AUTH0_JWKS (a JSON document), the
+# AUTH0_JWKS_FILE file or, by default, the Auth0 jwks endpoint
+JWKS_URL = 'https://{}/.well-known/jwks.json'
+JWKS_TTL = int(os.environ.get('AUTH0_JWKS_TTL', 3600))
+JWKS_MIN_REFRESH_INTERVAL = int(
+    os.environ.get('AUTH0_JWKS_MIN_REFRESH_INTERVAL', 30))
+
+# number of verified tokens kept in memory by each worker
+TOKEN_CACHE_SIZE = int(os.environ.get('AUTH0_TOKEN_CACHE_SIZE', 1024))
+
+logger = logging.getLogger('tree_app.auth')
 
 # AuthError Exception
 '''
@@ -22,6 +42,142 @@ class AuthError(Exception):
         self.status_code = status_code
 
 
+# JWKS Cache
+'''
+JWKSCache
+Process-wide cache of the signing keys, indexed by kid
+'''
+
+
+def load_jwks():
+    if os.environ.get('AUTH0_JWKS'):
+        return json.loads(os.environ['AUTH0_JWKS'])
+    if os.environ.get('AUTH0_JWKS_FILE'):
+        with open(os.environ['AUTH0_JWKS_FILE']) as jwks_file:
+            return json.load(jwks_file)
+    return json.loads(
+        urlopen(JWKS_URL.format(AUTH0_DOMAIN), timeout=10).read())
+
+
+class JWKSCache:
+    def __init__(self, loader=load_jwks, ttl=JWKS_TTL,
+                 min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL):
+        self.loader = loader
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.keys = None
+        self.fetched_at = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def refresh(self):
+        """Fetches the keys once, however many threads ask at the same time
+        """
+        requested_at = time.monotonic()
+        with self.refresh_lock:
+            # another thread refreshed the keys while this one was waiting
+            if self.fetched_at >= requested_at:
+                return
+            jwks = self.loader()
+            keys = {key['kid']: key for key in jwks['keys']}
+            with self.lock:
+                self.keys = keys
+                self.fetched_at = time.monotonic()
+
+    def refresh_in_background(self):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                # the stale keys keep being served until a refresh succeeds
+                logger.warning(f'Unable to refresh the JWKS: {e}')
+            finally:
+                with self.lock:
+                    self.refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get_key(self, kid):
+        """Returns the key with the given kid, or None if it is unknown
+        """
+        if self.keys is None:
+            self.refresh()
+
+        age = time.monotonic() - self.fetched_at
+        if kid not in self.keys and age >= self.min_refresh_interval:
+            # the keys may have been rotated
+            self.refresh()
+        elif age >= self.ttl:
+            self.refresh_in_background()
+
+        return self.keys.get(kid)
+
+
+jwks_cache = JWKSCache()
+
+
+# Token Cache
+'''
+TokenCache
+LRU cache of the verified token payloads, indexed by the token hash, each
+payload is dropped when its token expires
+'''
+
+
+class TokenCache:
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        key = self.key(token)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, token, payload):
+        # tokens without an expiry are verified every time
+        if 'exp' not in payload:
+            return
+        key = self.key(token)
+        with self.lock:
+            self.entries[key] = (payload, payload['exp'])
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries)
+            }
+
+
+token_cache = TokenCache()
+
+
 # Auth Header
 
 def get_token_auth_header():
@@ -60,8 +216,10 @@ def get_token_auth_header():
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
+    # jose and its crypto backend are imported by the first verification,
+    # which keeps them off the startup of the workers
+    from jose import jwt
+
     unverified_header = jwt.get_unverified_header(token)
     rsa_key = {}
     if 'kid' not in unverified_header:
@@ -70,15 +228,15 @@ def verify_decode_jwt(token):
             'description': 'Authorization malformed.'
         }, 401)
 
-    for key in jwks['keys']:
-        if key['kid'] == unverified_header['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
+    key = jwks_cache.get_key(unverified_header['kid'])
+    if key:
+        rsa_key = {
+            'kty': key['kty'],
+            'kid': key['kid'],
+            'use': key['use'],
+            'n': key['n'],
+            'e': key['e']
+        }
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -114,6 +272,18 @@ def verify_decode_jwt(token):
     }, 400)
 
 
+def decode_cached_jwt(token):
+    payload = token_cache.get(token)
+    if payload is None:
+        started = time.perf_counter()
+        try:
+            payload = verify_decode_jwt(token)
+        finally:
+            observe_jwt_verify(time.perf_counter() - started)
+        token_cache.set(token, payload)
+    return payload
+
+
 def check_permissions(permission, payload):
     if 'permissions' not in payload:
         abort(400)
@@ -131,7 +301,7 @@ def requires_auth(permission=''):
             except BaseException:
                 abort(401)
             try:
-                payload = verify_decode_jwt(token)
+                payload = decode_cached_jwt(token)
                 check_permissions(permission, payload)
             except BaseException:
                 abort(401)
@@ -0,0 +1,93 @@
+"""Times the bounding box and nearest forest searches
+
+Usage: python -m benchmarks.bench_geo --database-url <url> --forests 100000
+
+The database should be empty, the schema is created and the forests are
+seeded at random coordinates by the benchmark. --geo-index chooses the
+backend, the PostGIS one needs the indexes of the migrations.
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine
+
+from app import create_app
+from models import db, setup_db, Counter, version_key
+
+BATCH_SIZE = 10000
+
+
+def seed_forests(engine, forests):
+    random.seed(forests)
+    table = db.metadata.tables['forests']
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for start in range(0, forests, BATCH_SIZE):
+            connection.execute(table.insert(), [{
+                'name': f'Forest {i}',
+                'location': f'Location {i}',
+                'latitude': random.uniform(-60, 70),
+                'longitude': random.uniform(-180, 180)
+            } for i in range(start, min(start + BATCH_SIZE, forests))])
+
+
+def time_requests(client, paths):
+    samples = []
+    for path in paths:
+        started = time.perf_counter()
+        response = client.get(path)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.data
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--forests', type=int, default=100000)
+    parser.add_argument('--geo-index', default='auto')
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    seed_forests(create_engine(args.database_url), args.forests)
+    app = create_app({'RESPONSE_CACHE': 'none',
+                      'GEO_INDEX': args.geo_index})
+    setup_db(app, args.database_url)
+    with app.app_context():
+        # the in-memory grid is rebuilt on the next search
+        Counter.increment(version_key('forests'))
+        db.session.commit()
+    client = app.test_client()
+
+    started = time.perf_counter()
+    client.get('/forests/nearest?lat=0&lon=0&k=1')
+    print(f'first search (builds the grid): '
+          f'{(time.perf_counter() - started) * 1000:.1f}ms')
+
+    random.seed(0)
+    points = [(random.uniform(-60, 70), random.uniform(-180, 180))
+              for i in range(args.queries)]
+    searches = {
+        'nearest k=10': [f'/forests/nearest?lat={lat}&lon={lon}&k=10'
+                         for lat, lon in points],
+        'bbox 1x1 degrees': [
+            f'/forests/search?min_lat={lat}&min_lon={lon}'
+            f'&max_lat={lat + 1}&max_lon={min(lon + 1, 180)}'
+            for lat, lon in points],
+        'bbox 10x10 degrees': [
+            f'/forests/search?min_lat={lat}&min_lon={lon}'
+            f'&max_lat={min(lat + 10, 90)}&max_lon={min(lon + 10, 180)}'
+            for lat, lon in points],
+    }
+    print(f'{"search":<20}{"median (ms)":>12}{"max (ms)":>12}')
+    for label, paths in searches.items():
+        median, worst = time_requests(client, paths)
+        print(f'{label:<20}{median:>12.2f}{worst:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Times the per-forest and per-farmer tree queries with and without the
+trees indexes
+
+Usage: python -m benchmarks.bench_indexes --database-url <url> --trees 1000000
+
+The database should be empty, the schema is created and seeded by the
+benchmark.
+"""
+import argparse
+import os
+import statistics
+import time
+
+from sqlalchemy import create_engine, select, func, distinct
+
+from benchmarks.datagen import seed
+from models import Tree
+
+QUERIES = {
+    'forest trees by species': lambda id: select(
+        Tree.species_id, func.count(Tree.id)).where(
+        Tree.forest_id == id).group_by(Tree.species_id),
+    'forest farmer count': lambda id: select(
+        func.count(distinct(Tree.farmer_id))).where(Tree.forest_id == id),
+    'farmer trees by species': lambda id: select(
+        Tree.species_id, func.count(Tree.id)).where(
+        Tree.farmer_id == id).group_by(Tree.species_id),
+}
+
+
+def time_queries(engine, ids, repeat):
+    timings = {}
+    with engine.connect() as connection:
+        for label, query in QUERIES.items():
+            samples = []
+            for i in range(repeat):
+                for id in ids:
+                    started = time.perf_counter()
+                    connection.execute(query(id)).all()
+                    samples.append((time.perf_counter() - started) * 1000)
+            timings[label] = statistics.median(samples)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--trees', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    print(f'Seeding {args.trees} trees...')
+    seed(engine, args.trees)
+    ids = [1, 17, 42]
+    indexes = list(Tree.__table__.indexes)
+
+    for index in indexes:
+        index.drop(engine)
+    before = time_queries(engine, ids, args.repeat)
+
+    for index in indexes:
+        index.create(engine)
+    after = time_queries(engine, ids, args.repeat)
+
+    print(f'{"query":<28}{"no index (ms)":>16}{"indexed (ms)":>16}')
+    for label in QUERIES:
+        print(f'{label:<28}{before[label]:>16.2f}{after[label]:>16.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Times building and encoding the /trees list body with the ORM and
+jsonify, and with column rows and each json backend
+
+Usage: python -m benchmarks.bench_serialization --trees 100000
+
+Without --database-url the trees are seeded into a scratch SQLite file.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from flask import Flask, jsonify
+
+from benchmarks.datagen import seed
+from models import db, setup_db, Tree
+import serialization
+
+
+def orm_rows():
+    return [tree.format() for tree in Tree.query.order_by(Tree.id)]
+
+
+def column_rows():
+    return [Tree.to_dict(row)
+            for row in db.session.query(*Tree.columns()).order_by(Tree.id)]
+
+
+def time_variant(build, encode, repeat):
+    build_samples, encode_samples = [], []
+    for i in range(repeat):
+        started = time.perf_counter()
+        trees = build()
+        built = time.perf_counter()
+        encode({'success': True, 'trees': trees})
+        encoded = time.perf_counter()
+        # the identity map would make the next ORM build cheaper
+        db.session.expunge_all()
+        build_samples.append((built - started) * 1000)
+        encode_samples.append((encoded - built) * 1000)
+    return statistics.median(build_samples), statistics.median(encode_samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url')
+    parser.add_argument('--trees', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url is None:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        args.database_url = f'sqlite:///{scratch.name}'
+
+    app = Flask(__name__)
+    setup_db(app, args.database_url)
+    try:
+        with app.app_context():
+            print(f'Seeding {args.trees} trees...')
+            seed(db.engine, args.trees)
+
+            variants = [('orm + jsonify', orm_rows,
+                         lambda body: jsonify(body).get_data())]
+            for name in serialization.BACKENDS:
+                variants.append((f'columns + {name}', column_rows,
+                                 serialization.BACKENDS[name]))
+
+            print(f'{"variant":<20} {"build ms":>10} {"encode ms":>10} '
+                  f'{"total ms":>10}')
+            for label, build, encode in variants:
+                build_ms, encode_ms = time_variant(build, encode, args.repeat)
+                print(f'{label:<20} {build_ms:>10.1f} {encode_ms:>10.1f} '
+                      f'{build_ms + encode_ms:>10.1f}')
+    finally:
+        if scratch is not None:
+            os.remove(scratch.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Compares the sync (gthread) and async (gevent) gunicorn workers on the
+read endpoints as the number of concurrent clients grows
+
+Usage: python -m benchmarks.bench_serving --database-url <url> \\
+    --concurrency 16,64,256
+
+Both worker classes run with the same number of workers and connection
+pool. The gthread workers serve --threads requests at once each, the gevent
+workers up to --worker-connections, so the difference shows once there are
+more clients than threads. The response cache is disabled unless
+--response-cache is given, so every request reaches the database.
+"""
+import argparse
+import os
+
+from sqlalchemy import create_engine
+
+from benchmarks.datagen import seed, reconcile
+from benchmarks.load_test import READ_CALLS, start_server
+from benchmarks.loadgen import run_load
+
+WORKER_CLASSES = ('gthread', 'gevent')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='number of trees to seed first, 0 to skip')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--worker-connections', type=int, default=1000)
+    parser.add_argument('--pool-size', type=int, default=5)
+    parser.add_argument('--concurrency', default='16,64,256')
+    parser.add_argument('--duration', type=int, default=10)
+    parser.add_argument('--port', type=int, default=8125)
+    parser.add_argument('--response-cache', default='none')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(create_engine(args.database_url), args.seed)
+        reconcile(args.database_url)
+
+    print(f'{"worker":>8}{"clients":>9}{"req/s":>10}{"p50 (ms)":>10}'
+          f'{"p99 (ms)":>10}{"errors":>8}')
+    for worker_class in WORKER_CLASSES:
+        env = dict(os.environ,
+                   DATABASE_URL=args.database_url,
+                   WEB_CONCURRENCY=str(args.workers),
+                   GUNICORN_WORKER_CLASS=worker_class,
+                   GUNICORN_THREADS=str(args.threads),
+                   GUNICORN_WORKER_CONNECTIONS=str(args.worker_connections),
+                   DB_POOL_SIZE=str(args.pool_size),
+                   RESPONSE_CACHE=args.response_cache)
+        server = start_server(args.port, env)
+        try:
+            for concurrency in [int(n) for n in args.concurrency.split(',')]:
+                stats = run_load(f'http://127.0.0.1:{args.port}', READ_CALLS,
+                                 concurrency, args.duration)
+                print(f'{worker_class:>8}{concurrency:>9}'
+                      f'{stats["throughput"]:>10}{stats["p50_ms"]:>10}'
+                      f'{stats["p99_ms"]:>10}{stats["errors"]:>8}')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Times the startup of the app: importing app.py, the first request, the
+first database request, and a gunicorn boot until its first response
+
+Usage: python -m benchmarks.bench_startup --database-url <url> --repeat 10
+
+Every measure starts a new interpreter, so the imports are not cached.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.load_test import start_server
+
+PROBE = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+client.get('/')
+first_request = time.perf_counter()
+client.get('/forests')
+first_query = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (first_request - imported) * 1000,
+    'first_query_ms': (first_query - first_request) * 1000,
+}))
+'''
+
+
+def probe(env):
+    output = subprocess.check_output([sys.executable, '-c', PROBE], env=env,
+                                     stderr=subprocess.DEVNULL)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def gunicorn_boot(env, port):
+    started = time.perf_counter()
+    server = start_server(port, env)
+    elapsed = (time.perf_counter() - started) * 1000
+    server.terminate()
+    server.wait()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--port', type=int, default=8124)
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=args.database_url,
+               RESPONSE_CACHE='none', WEB_CONCURRENCY='1')
+    samples = {}
+    for i in range(args.repeat):
+        for name, value in probe(env).items():
+            samples.setdefault(name, []).append(value)
+        samples.setdefault('gunicorn_boot_ms', []).append(
+            gunicorn_boot(env, args.port))
+
+    print(f'{"measure":<20}{"median (ms)":>12}{"max (ms)":>12}')
+    for name, values in samples.items():
+        print(f'{name:<20}{statistics.median(values):>12.1f}'
+              f'{max(values):>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
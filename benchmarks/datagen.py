@@ -0,0 +1,92 @@
+"""Seeds synthetic farmers, forests and trees into a database
+
+Usage: python -m benchmarks.datagen --database-url <url> --trees 1000000
+"""
+import argparse
+import os
+import time
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+from models import db, setup_db, Counter, TreeStat
+
+SPECIES = ['Palm', 'Platano', 'Cactus', 'Oak', 'Pine', 'Cedar', 'Baobab',
+           'Mango', 'Avocado', 'Cacao', 'Coffee', 'Teak', 'Acacia',
+           'Eucalyptus', 'Moringa', 'Neem', 'Olive', 'Walnut', 'Cherry',
+           'Maple']
+BATCH_SIZE = 10000
+
+
+def seed(engine, trees, farmers=1000, forests=100, species=len(SPECIES)):
+    """Creates the schema and inserts the rows, returns the seconds spent"""
+    started = time.perf_counter()
+    db.metadata.create_all(engine)
+    species = SPECIES[:species]
+    with engine.begin() as connection:
+        connection.execute(db.metadata.tables['farmers'].insert(), [
+            {'id': i, 'name': f'Farmer {i}'} for i in range(1, farmers + 1)])
+        connection.execute(db.metadata.tables['forests'].insert(), [
+            {'id': i, 'name': f'Forest {i}', 'location': f'Location {i}'}
+            for i in range(1, forests + 1)])
+        connection.execute(db.metadata.tables['species'].insert(), [
+            {'id': i, 'name': name} for i, name in enumerate(species, 1)])
+
+        if engine.dialect.name == 'postgresql':
+            # generating the rows server side is much faster at 10M rows
+            connection.execute(text(
+                "INSERT INTO trees (species_id, farmer_id, forest_id) "
+                "SELECT 1 + i % :n_species, "
+                "1 + i % :farmers, 1 + (i * 7) % :forests "
+                "FROM generate_series(1, :trees) AS i"), {
+                'n_species': len(species),
+                'farmers': farmers, 'forests': forests, 'trees': trees})
+            # the ids above were given explicitly
+            connection.execute(text(
+                "SELECT setval('farmers_id_seq', :farmers), "
+                "setval('forests_id_seq', :forests), "
+                "setval('species_id_seq', :species)"),
+                {'farmers': farmers, 'forests': forests,
+                 'species': len(species)})
+            connection.execute(text('ANALYZE trees'))
+        else:
+            table = db.metadata.tables['trees']
+            for start in range(1, trees + 1, BATCH_SIZE):
+                connection.execute(table.insert(), [{
+                    'species_id': 1 + i % len(species),
+                    'farmer_id': 1 + i % farmers,
+                    'forest_id': 1 + (i * 7) % forests
+                } for i in range(start, min(start + BATCH_SIZE, trees + 1))])
+    return time.perf_counter() - started
+
+
+def reconcile(database_url):
+    """Rebuilds the counters and tree statistics of the seeded rows"""
+    app = Flask(__name__)
+    setup_db(app, database_url)
+    with app.app_context():
+        Counter.reconcile()
+        TreeStat.reconcile()
+        db.session.remove()
+        db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--trees', type=int, default=1000000)
+    parser.add_argument('--farmers', type=int, default=1000)
+    parser.add_argument('--forests', type=int, default=100)
+    parser.add_argument('--species', type=int, default=len(SPECIES))
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    seconds = seed(engine, args.trees, args.farmers, args.forests,
+                   args.species)
+    reconcile(args.database_url)
+    print(f'Seeded {args.trees} trees in {seconds:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
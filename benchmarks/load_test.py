@@ -0,0 +1,84 @@
+"""Measures the throughput of the read endpoints under gunicorn for several
+worker counts
+
+Usage: python -m benchmarks.load_test --database-url <url> --workers 1,2,4
+
+The app is started with gunicorn.conf.py, so the DB_* and GUNICORN_*
+variables apply. The response cache is disabled unless --response-cache is
+given, so the requests reach the database.
+"""
+import argparse
+import os
+import subprocess
+import time
+
+import requests
+from sqlalchemy import create_engine
+
+from benchmarks.datagen import seed
+from benchmarks.loadgen import run_load
+
+READ_CALLS = [
+    ('GET', '/trees', None),
+    ('GET', '/forests', None),
+    ('GET', '/farmers', None),
+    ('GET', '/forests/1', None),
+    ('GET', '/farmers/1', None),
+]
+
+
+def start_server(port, env):
+    server = subprocess.Popen(
+        ['gunicorn', '-c', 'gunicorn.conf.py', '--bind',
+         f'127.0.0.1:{port}', 'app:app'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for i in range(100):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=1)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='number of trees to seed first, 0 to skip')
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--worker-class', default='gthread')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=int, default=10)
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--response-cache', default='none')
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(create_engine(args.database_url), args.seed)
+
+    print(f'{"workers":>8}{"req/s":>10}{"p50 (ms)":>10}{"p99 (ms)":>10}'
+          f'{"errors":>8}')
+    for workers in [int(n) for n in args.workers.split(',')]:
+        env = dict(os.environ,
+                   DATABASE_URL=args.database_url,
+                   WEB_CONCURRENCY=str(workers),
+                   GUNICORN_WORKER_CLASS=args.worker_class,
+                   GUNICORN_THREADS=str(args.threads),
+                   RESPONSE_CACHE=args.response_cache)
+        server = start_server(args.port, env)
+        try:
+            stats = run_load(f'http://127.0.0.1:{args.port}', READ_CALLS,
+                             args.concurrency, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+        print(f'{workers:>8}{stats["throughput"]:>10}{stats["p50_ms"]:>10}'
+              f'{stats["p99_ms"]:>10}{stats["errors"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
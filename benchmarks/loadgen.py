@@ -0,0 +1,65 @@
+"""Concurrent HTTP load generator used by the benchmarks"""
+import itertools
+import statistics
+import threading
+import time
+
+import requests
+
+
+def percentile(samples, percent):
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * percent / 100))]
+
+
+def run_load(base_url, calls, concurrency=8, duration=10, headers=None):
+    """Sends the calls, (method, path, json body) tuples, round robin from
+    concurrency threads for duration seconds and returns the statistics
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(offset):
+        session = requests.Session()
+        session.headers.update(headers or {})
+        samples, failed = [], 0
+        # each thread takes every concurrency-th call, so calls that must
+        # happen once, like deleting a given tree, are not repeated
+        for method, path, body in itertools.islice(
+                itertools.cycle(calls), offset, None, concurrency):
+            if time.perf_counter() >= deadline:
+                break
+            started = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path,
+                                           json=body, timeout=30)
+                if response.status_code >= 400:
+                    failed += 1
+            except requests.RequestException:
+                failed += 1
+            samples.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(samples)
+            errors.append(failed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'throughput': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(statistics.mean(latencies), 2) if latencies else 0
+    }
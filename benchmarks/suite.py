@@ -0,0 +1,209 @@
+"""Drives every endpoint of the app with concurrent clients and records the
+latency and throughput of each to a JSON baseline
+
+Usage:
+    python -m benchmarks.suite --database-url <url> --seed 1000000 \\
+        --save baseline.json
+    python -m benchmarks.suite --database-url <url> --compare baseline.json
+
+The app is started under gunicorn with a local JWKS, and the requests carry
+tokens minted for it (see benchmarks.tokens), so no Auth0 tenant is needed.
+Each scenario loads one endpoint for --duration seconds. With --compare, the
+command fails when a scenario lost more than --tolerance of its throughput
+or of its p99 latency against the baseline. The write scenarios change the
+data, reseed the database to compare runs.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import create_engine, func, select
+
+from benchmarks.datagen import seed, reconcile
+from benchmarks.load_test import start_server
+from benchmarks.loadgen import run_load
+from benchmarks.tokens import LocalIssuer
+from models import db
+
+DOMAIN = 'benchmark.local'
+AUDIENCE = 'tree-benchmark'
+CURSORS = 50
+
+
+def scenarios(farmers, forests, trees, max_tree_id):
+    # (name, calls), the calls are (method, path, json body) tuples
+    page = max(1, trees // CURSORS)
+    return [
+        ('home', [('GET', '/', None)]),
+        ('list_trees', [('GET', f'/trees?after={i * page}', None)
+                        for i in range(CURSORS)]),
+        ('export_trees', [('GET', f'/trees?format=ndjson&after='
+                           f'{max(0, max_tree_id - 10000)}', None)]),
+        ('list_forests', [('GET', '/forests', None)]),
+        ('list_farmers', [('GET', '/farmers', None)]),
+        ('get_forest', [('GET', f'/forests/{id}', None)
+                        for id in range(1, forests + 1)]),
+        ('get_farmer', [('GET', f'/farmers/{id}', None)
+                        for id in range(1, min(farmers, 1000) + 1)]),
+        ('tree_stats', [('GET', f'/stats/trees?group_by={group_by}', None)
+                        for group_by in ('name', 'location,name',
+                                         'farmer_id')]),
+        ('create_farmer', [('POST', '/farmers',
+                            {'name': 'Benchmark farmer'})]),
+        ('create_forest', [('POST', '/forests',
+                            {'name': 'Benchmark forest',
+                             'location': 'Benchmark'})]),
+        ('update_farmer', [('PATCH', f'/farmers/{id}',
+                            {'name': f'Farmer {id}'})
+                           for id in range(1, min(farmers, 1000) + 1)]),
+        ('plant_trees', [('POST', '/trees', {
+            'name': 'Oak', 'farmer_id': 1 + i % farmers,
+            'forest_id': 1 + i % forests, 'quantity': 10})
+            for i in range(100)]),
+        # a one line file, the import itself runs in the background of the
+        # worker that received it
+        ('create_import', [('POST', '/imports?format=ndjson',
+                            {'type': 'farmer', 'name': 'Imported farmer'})]),
+        # the imports queued by the scenario above
+        ('get_import', [('GET', f'/imports/{id}', None)
+                        for id in range(1, CURSORS + 1)]),
+        ('metrics', [('GET', '/metrics', None)]),
+        # every call deletes another seeded tree, from the last one down
+        ('delete_tree', [('DELETE', f'/trees/{id}', None)
+                         for id in range(max_tree_id,
+                                         max(0, max_tree_id - 100000), -1)]),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    '''Prints the change of each scenario, returns the regressed ones'''
+    regressions = []
+    print(f'{"scenario":<16}{"req/s":>10}{"base":>10}{"p99 (ms)":>10}'
+          f'{"base":>10}')
+    for name, stats in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        print(f'{name:<16}{stats["throughput"]:>10}{base["throughput"]:>10}'
+              f'{stats["p99_ms"]:>10}{base["p99_ms"]:>10}')
+        if stats['throughput'] < base['throughput'] * (1 - tolerance) or \
+                stats['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--database-url',
+                        default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--seed', type=int, default=0,
+                        help='number of trees to seed first, 0 to skip')
+    parser.add_argument('--farmers', type=int, default=1000)
+    parser.add_argument('--forests', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=int, default=5)
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--response-cache', default='none')
+    parser.add_argument('--scenarios',
+                        help='comma separated scenarios, all by default')
+    parser.add_argument('--save', help='file to write the results to')
+    parser.add_argument('--compare', help='baseline file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    if args.seed:
+        print(f'Seeding {args.seed} trees...')
+        seed(engine, args.seed, args.farmers, args.forests)
+        reconcile(args.database_url)
+    trees_table = db.metadata.tables['trees']
+    with engine.connect() as connection:
+        trees = connection.execute(
+            select(func.count()).select_from(trees_table)).scalar()
+        max_tree_id = connection.execute(
+            select(func.max(trees_table.c.id))).scalar() or 0
+    engine.dispose()
+
+    issuer = LocalIssuer(DOMAIN, AUDIENCE)
+    jwks = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+    jwks.close()
+    issuer.write_jwks(jwks.name)
+    env = dict(os.environ,
+               DATABASE_URL=args.database_url,
+               AUTH0_DOMAIN=DOMAIN,
+               AUTH0_ALGORITHMS='RS256',
+               API_AUDIENCE=AUDIENCE,
+               AUTH0_JWKS_FILE=jwks.name,
+               WEB_CONCURRENCY=str(args.workers),
+               GUNICORN_THREADS=str(args.threads),
+               RESPONSE_CACHE=args.response_cache)
+    headers = {'Authorization': f'Bearer {issuer.token()}'}
+
+    selected = args.scenarios.split(',') if args.scenarios else None
+    results = {}
+    server = start_server(args.port, env)
+    try:
+        print(f'{"scenario":<16}{"req/s":>10}{"p50 (ms)":>10}'
+              f'{"p99 (ms)":>10}{"errors":>8}')
+        for name, calls in scenarios(args.farmers, args.forests, trees,
+                                     max_tree_id):
+            if selected and name not in selected:
+                continue
+            stats = run_load(f'http://127.0.0.1:{args.port}', calls,
+                             args.concurrency, args.duration, headers)
+            results[name] = stats
+            print(f'{name:<16}{stats["throughput"]:>10}{stats["p50_ms"]:>10}'
+                  f'{stats["p99_ms"]:>10}{stats["errors"]:>8}')
+    finally:
+        server.terminate()
+        server.wait()
+        os.remove(jwks.name)
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(),
+        'commit': git_commit(),
+        'config': {
+            'trees': trees,
+            'farmers': args.farmers,
+            'forests': args.forests,
+            'workers': args.workers,
+            'threads': args.threads,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'response_cache': args.response_cache
+        },
+        'results': results
+    }
+    if args.save:
+        with open(args.save, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f'Saved the results to {args.save}')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f'Regressed: {", ".join(regressions)}')
+            sys.exit(1)
+        print('No regression')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Mints test tokens signed by a local key, so the benchmarks do not need
+Auth0 or real ADMIN_TOKEN and FARMER_TOKEN tokens
+
+The app accepts them when AUTH0_JWKS_FILE points to the jwks written by
+LocalIssuer.write_jwks, AUTH0_DOMAIN and API_AUDIENCE being the ones the
+tokens were minted for.
+"""
+import base64
+import json
+import time
+import uuid
+
+import rsa
+from jose import jwt
+
+ADMIN_PERMISSIONS = ['post:farmer', 'patch:farmer', 'post:forest',
+                     'post:tree', 'delete:tree', 'post:import']
+FARMER_PERMISSIONS = ['post:tree']
+
+
+def b64_number(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+class LocalIssuer:
+    def __init__(self, domain, audience, bits=2048):
+        self.domain = domain
+        self.audience = audience
+        self.kid = uuid.uuid4().hex
+        public_key, private_key = rsa.newkeys(bits)
+        self.private_key = private_key.save_pkcs1().decode()
+        self.jwks = {'keys': [{
+            'kty': 'RSA',
+            'kid': self.kid,
+            'use': 'sig',
+            'alg': 'RS256',
+            'n': b64_number(public_key.n),
+            'e': b64_number(public_key.e)
+        }]}
+
+    def write_jwks(self, path):
+        with open(path, 'w') as jwks_file:
+            json.dump(self.jwks, jwks_file)
+
+    def token(self, permissions=ADMIN_PERMISSIONS, ttl=3600,
+              subject='benchmark'):
+        now = int(time.time())
+        return jwt.encode({
+            'iss': f'https://{self.domain}/',
+            'sub': subject,
+            'aud': self.audience,
+            'iat': now,
+            'exp': now + ttl,
+            'permissions': permissions
+        }, self.private_key, algorithm='RS256', headers={'kid': self.kid})
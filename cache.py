@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, make_response, Response
+
+from models import Counter, version_key
+
+'''
+Response cache
+The GET endpoints are cached by url and by version of the tables they read.
+Every write bumps the version of the tables it touches (see models.touch),
+so a cached body is never served once its data changed, and clients can
+revalidate with If-None-Match. There is no Last-Modified, a second is too
+coarse to tell apart the writes landing in the second of a read.
+
+The backend is chosen with RESPONSE_CACHE:
+- memory: a per worker LRU (default)
+- redis: shared between the workers, at RESPONSE_CACHE_URL
+- none: disables the cache
+'''
+
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', 'memory')
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL')
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 3600))
+
+
+class MemoryCache:
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE,
+                 timeout=RESPONSE_CACHE_TIMEOUT):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+class RedisCache:
+    def __init__(self, url=RESPONSE_CACHE_URL,
+                 timeout=RESPONSE_CACHE_TIMEOUT):
+        # redis is only needed when the shared backend is used
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.timeout = timeout
+
+    def get(self, key):
+        # the entries are stored as plain bytes, nothing read back from
+        # redis is unpickled
+        entry = self.client.hgetall(f'response:{key}')
+        if not entry:
+            return None
+        return entry[b'body'], entry[b'mimetype'].decode()
+
+    def set(self, key, value):
+        body, mimetype = value
+        with self.client.pipeline() as pipeline:
+            pipeline.hset(f'response:{key}',
+                          mapping={'body': body, 'mimetype': mimetype})
+            pipeline.expire(f'response:{key}', self.timeout)
+            pipeline.execute()
+
+
+class ResponseCache:
+    def __init__(self, backend):
+        self.backend = backend
+
+    @classmethod
+    def from_config(cls, config):
+        name = config.get('RESPONSE_CACHE', RESPONSE_CACHE)
+        if name == 'none':
+            return cls(None)
+        if name == 'redis':
+            return cls(RedisCache(
+                config.get('RESPONSE_CACHE_URL', RESPONSE_CACHE_URL)))
+        if name == 'memory':
+            return cls(MemoryCache())
+        raise ValueError(f'Unknown response cache backend: {name}')
+
+    def cached(self, *tables):
+        '''Caches the json responses of a GET endpoint reading the tables'''
+        def cached_decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if self.backend is None:
+                    return f(*args, **kwargs)
+
+                # the versions are read before the data, so a write landing
+                # in between only makes the entry stale for the next version
+                versions = Counter.get_many(
+                    [version_key(table) for table in tables])
+                key = hashlib.sha1(json.dumps(
+                    [request.full_path, versions],
+                    sort_keys=True).encode()).hexdigest()
+
+                entry = self.backend.get(key)
+                if entry is None:
+                    response = make_response(f(*args, **kwargs))
+                    # errors and streamed exports are not cached
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    entry = (response.get_data(), response.mimetype)
+                    self.backend.set(key, entry)
+
+                body, mimetype = entry
+                response = Response(body, mimetype=mimetype)
+                response.set_etag(key)
+                response.cache_control.no_cache = True
+                return response.make_conditional(request)
+
+            return wrapper
+        return cached_decorator
@@ -0,0 +1,179 @@
+import heapq
+import math
+import os
+import threading
+
+from sqlalchemy import text
+
+from models import db, Forest, Counter, version_key
+
+'''
+Geospatial search
+Forests may carry a latitude and a longitude. The bounding box and nearest
+forest searches use PostGIS when the extension is installed in the
+database, through the GiST indexes of the add forest coordinates migration.
+Otherwise each worker keeps an in-memory grid of the forest coordinates,
+GEO_GRID_CELL_DEGREES wide cells, rebuilt whenever the forests table
+version changes.
+
+GEO_INDEX forces a backend: postgis, grid, or auto (default).
+'''
+
+GEO_INDEX = os.environ.get('GEO_INDEX', 'auto')
+GEO_GRID_CELL_DEGREES = float(os.environ.get('GEO_GRID_CELL_DEGREES', 1))
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+POINT = 'ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)'
+BBOX_QUERY = (
+    f'SELECT id FROM forests WHERE {POINT} && '
+    'ST_MakeEnvelope(:min_lon, :min_lat, :max_lon, :max_lat, 4326) '
+    'ORDER BY id LIMIT :limit')
+NEAREST_QUERY = (
+    f'SELECT id FROM forests WHERE latitude IS NOT NULL '
+    f'ORDER BY {POINT}::geography <-> '
+    'ST_SetSRID(ST_MakePoint(:lon, :lat), 4326)::geography LIMIT :k')
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # great circle distance, haversine formula
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(
+        lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1, math.sqrt(a)))
+
+
+class GridIndex:
+    def __init__(self, cell_degrees=GEO_GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.rows = math.ceil(180 / cell_degrees)
+        self.columns = math.ceil(360 / cell_degrees)
+        self.cells = {}
+        self.size = 0
+        self.version = None
+        self.lock = threading.Lock()
+
+    def cell(self, lat, lon):
+        return (min(int((lat + 90) // self.cell_degrees), self.rows - 1),
+                int((lon + 180) // self.cell_degrees) % self.columns)
+
+    def refresh(self):
+        # the version is read first, a forest written while the grid is
+        # built only makes it stale for the next version
+        version = Counter.get(version_key('forests'))
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            cells = {}
+            for id, lat, lon in db.session.query(
+                    Forest.id, Forest.latitude, Forest.longitude).filter(
+                    Forest.latitude.isnot(None),
+                    Forest.longitude.isnot(None)):
+                cells.setdefault(self.cell(lat, lon), []).append(
+                    (id, lat, lon))
+            self.cells = cells
+            self.size = sum(len(points) for points in cells.values())
+            self.version = version
+
+    def points(self, min_lat, min_lon, max_lat, max_lon):
+        # the forests of the cells overlapping the box, longitudes beyond
+        # +-180 wrapping around
+        cells = self.cells
+        rows = range(self.cell(max(min_lat, -90), 0)[0],
+                     self.cell(min(max_lat, 90), 0)[0] + 1)
+        if max_lon - min_lon >= 360:
+            columns = set(range(self.columns))
+        else:
+            columns = {column % self.columns for column in range(
+                int((min_lon + 180) // self.cell_degrees),
+                int((max_lon + 180) // self.cell_degrees) + 1)}
+        if len(rows) * len(columns) > len(cells):
+            # a large box visits fewer cells through the occupied ones
+            keys = [key for key in cells
+                    if key[0] in rows and key[1] in columns]
+        else:
+            keys = [(row, column) for row in rows for column in columns]
+        for key in keys:
+            yield from cells.get(key, ())
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, limit):
+        self.refresh()
+        return heapq.nsmallest(limit, (
+            id for id, lat, lon in self.points(
+                min_lat, min_lon, max_lat, max_lon)
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon))
+
+    def nearest(self, lat, lon, k):
+        self.refresh()
+        # growing boxes of cells around the point are searched until k
+        # forests are found, the k-th one bounds the distance to search
+        candidates = []
+        span = self.cell_degrees / 2
+        while len(candidates) < min(k, self.size):
+            span *= 2
+            candidates = list(self.points(
+                lat - span, lon - span, lat + span, lon + span))
+        if not candidates:
+            return []
+        candidates = sorted(
+            (distance_km(lat, lon, point_lat, point_lon), id)
+            for id, point_lat, point_lon in candidates)
+        limit = candidates[min(k, len(candidates)) - 1][0]
+
+        # the box around the circle of that radius holds the k nearest
+        lat_span = limit / KM_PER_DEGREE
+        lon_span = 360
+        if abs(lat) + lat_span < 90:
+            ratio = math.sin(limit / EARTH_RADIUS_KM) / math.cos(
+                math.radians(lat))
+            if ratio < 1:
+                lon_span = math.degrees(math.asin(ratio))
+        nearest = sorted(
+            (distance_km(lat, lon, point_lat, point_lon), id)
+            for id, point_lat, point_lon in self.points(
+                lat - lat_span, lon - lon_span, lat + lat_span,
+                lon + lon_span))
+        return [id for distance, id in nearest[:k]]
+
+
+class GeoIndex:
+    def __init__(self, backend=GEO_INDEX, cell_degrees=GEO_GRID_CELL_DEGREES):
+        if backend not in ('auto', 'postgis', 'grid'):
+            raise ValueError(f'Unknown geo index: {backend}')
+        self.backend = backend
+        self.grid = GridIndex(cell_degrees)
+        self.postgis = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('GEO_INDEX', GEO_INDEX),
+                   config.get('GEO_GRID_CELL_DEGREES', GEO_GRID_CELL_DEGREES))
+
+    def uses_postgis(self):
+        if self.postgis is None:
+            if self.backend == 'auto':
+                self.postgis = db.engine.dialect.name == 'postgresql' and \
+                    db.session.execute(text(
+                        "SELECT count(*) FROM pg_extension "
+                        "WHERE extname = 'postgis'")).scalar() > 0
+            else:
+                self.postgis = self.backend == 'postgis'
+        return self.postgis
+
+    def bbox(self, min_lat, min_lon, max_lat, max_lon, limit):
+        '''Returns the ids of the forests in the box, by id'''
+        if self.uses_postgis():
+            return db.session.execute(text(BBOX_QUERY), {
+                'min_lat': min_lat, 'min_lon': min_lon, 'max_lat': max_lat,
+                'max_lon': max_lon, 'limit': limit}).scalars().all()
+        return self.grid.bbox(min_lat, min_lon, max_lat, max_lon, limit)
+
+    def nearest(self, lat, lon, k):
+        '''Returns the ids of the k forests nearest to the point, nearest
+        first'''
+        if self.uses_postgis():
+            return db.session.execute(text(NEAREST_QUERY), {
+                'lat': lat, 'lon': lon, 'k': k}).scalars().all()
+        return self.grid.nearest(lat, lon, k)
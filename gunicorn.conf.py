@@ -0,0 +1,56 @@
+import multiprocessing
+import os
+
+# gunicorn binds to $PORT when it is set, as on Heroku
+
+# WEB_CONCURRENCY is set by Heroku from the dyno size
+workers = int(os.environ.get(
+    'WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+# gthread workers serve GUNICORN_THREADS requests at once, sharing the
+# worker's connection pool, so DB_POOL_SIZE + DB_MAX_OVERFLOW should be at
+# least the number of threads. gevent workers serve up to
+# GUNICORN_WORKER_CONNECTIONS requests at once on greenlets, the requests
+# waiting for a pooled connection without blocking the others
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 100))
+
+if worker_class == 'gevent':
+    # the standard library is patched before the app is preloaded, so the
+    # locks, sockets and threads of its modules cooperate with the
+    # greenlets, and psycopg2 yields to the other requests while waiting on
+    # PostgreSQL
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+        if os.environ.get('DATABASE_URL', '').startswith('postgres'):
+            from psycogreen.gevent import patch_psycopg
+            patch_psycopg()
+    except ImportError as e:
+        raise RuntimeError('The gevent workers need the gevent and '
+                           'psycogreen packages of requirements.txt') from e
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 0))
+# the app is imported once by the master and the workers are forked from it,
+# which is safe as importing it does not connect to the database
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true') == 'true'
+
+
+def post_fork(server, worker):
+    if os.environ.get('AUTH0_DOMAIN'):
+        # the signing keys are fetched while the worker starts, rather than
+        # by its first authenticated request
+        from auth import jwks_cache
+        jwks_cache.refresh_in_background()
+
+    if preload_app:
+        # the connections opened by the master must not be shared with the
+        # workers
+        from app import app
+        from models import db
+        with app.app_context():
+            db.engine.dispose()
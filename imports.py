@@ -0,0 +1,370 @@
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from models import (db, Import, Farmer, Forest, Tree, Planting, species_cache,
+                    TREE_STORAGE, MAX_PLANTING_QUANTITY)
+
+'''
+Bulk imports
+An import file holds one farmer, forest or tree per row, as newline
+delimited json or csv with a header line naming the columns, among type,
+ref, name, location, latitude, longitude, farmer_id, farmer_ref, forest_id,
+forest_ref and quantity
+
+- farmer rows need a name, forest rows a name, a location and optionally
+  their coordinates
+- tree rows need a name, a farmer and a forest, given either by the id of an
+  existing row (farmer_id, forest_id) or by the ref of a farmer or forest
+  defined earlier in the same file (farmer_ref, forest_ref), and an optional
+  quantity (1 by default, at most MAX_IMPORT_QUANTITY)
+
+The file is saved to IMPORTS_DIR and loaded by a pool of background threads
+of the worker that received it, in transactions of about IMPORT_CHUNK_SIZE
+rows, the trees of a large quantity being split across the transactions.
+The progress is stored in the imports table, so any worker can report
+it. Rows that fail validation are counted and skipped, the first
+MAX_IMPORT_ERRORS errors are kept with their line number. An import still
+queued or running IMPORT_STALE_AFTER hours after it was queued or started
+was lost with its worker (deploy, restart, crash), it is marked as failed
+and its file removed when an import is polled.
+'''
+
+IMPORTS_DIR = os.environ.get(
+    'IMPORTS_DIR', os.path.join(tempfile.gettempdir(), 'tree-imports'))
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 2))
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+MAX_IMPORT_ERRORS = 100
+# trees of a single tree row, the plantings storage writes them as one row
+MAX_IMPORT_QUANTITY = 1000000
+ID_BATCH_SIZE = 1000
+IMPORT_STALE_AFTER = int(os.environ.get('IMPORT_STALE_AFTER', 6))
+
+IMPORT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'ndjson': ('.ndjson', 'application/x-ndjson'),
+}
+
+
+class InvalidRow(Exception):
+    pass
+
+
+def detect_format(filename, mimetype):
+    for file_format, (extension, format_mimetype) in IMPORT_FORMATS.items():
+        if mimetype == format_mimetype or (
+                filename and filename.lower().endswith(extension)):
+            return file_format
+    return None
+
+
+def read_rows(stream, file_format):
+    # yields the line number and the row of each record of the file
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if file_format == 'csv':
+        for line, row in enumerate(csv.DictReader(text), start=2):
+            yield line, {key: value for key, value in row.items()
+                         if value not in ('', None)}
+        return
+
+    for line, raw in enumerate(text, start=1):
+        if not raw.strip():
+            continue
+        try:
+            yield line, json.loads(raw)
+        except ValueError:
+            yield line, None
+
+
+def to_int(row, field, default=None):
+    # csv values are strings, json values must be integers already
+    value = row.get(field, default)
+    if value is None:
+        return None
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    try:
+        if isinstance(value, str):
+            return int(value)
+    except ValueError:
+        pass
+    raise InvalidRow(f'{field} must be an integer')
+
+
+def required(row, field):
+    value = row.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise InvalidRow(f'{field} is required')
+    return value
+
+
+def coordinates(row):
+    # the optional latitude and longitude of a forest, given together
+    values = {}
+    for field, bound in (('latitude', 90), ('longitude', 180)):
+        value = row.get(field)
+        if value is not None:
+            try:
+                if isinstance(value, bool):
+                    raise ValueError
+                value = float(value)
+            except (TypeError, ValueError):
+                raise InvalidRow(f'{field} must be a number')
+            if not -bound <= value <= bound:
+                raise InvalidRow(f'{field} must be between -{bound} and '
+                                 f'{bound}')
+        values[field] = value
+    if (values['latitude'] is None) != (values['longitude'] is None):
+        raise InvalidRow('latitude and longitude must be given together')
+    return values
+
+
+class ImportLoader:
+    def __init__(self, job, chunk_size=IMPORT_CHUNK_SIZE,
+                 storage=TREE_STORAGE):
+        self.job = job
+        self.chunk_size = chunk_size
+        self.storage = storage
+        self.farmers = []
+        self.forests = []
+        self.trees = []
+        self.buffered = 0
+        self.failed = 0
+        self.errors = []
+        self.refs = {Farmer: {}, Forest: {}}
+        self.known_ids = {Farmer: set(), Forest: set()}
+
+    def fail(self, line, error):
+        self.failed += 1
+        if len(self.errors) < MAX_IMPORT_ERRORS:
+            self.errors.append({'line': line, 'error': error})
+
+    def reference(self, row, name):
+        # a tree points to an existing row by id, or to a row of the file
+        # by ref
+        if row.get(f'{name}_ref') is not None:
+            return 'ref', str(row[f'{name}_ref'])
+        id = to_int(row, f'{name}_id')
+        if id is None:
+            raise InvalidRow(f'{name}_id or {name}_ref is required')
+        return 'id', id
+
+    def parse(self, line, row):
+        if not isinstance(row, dict):
+            raise InvalidRow('invalid row')
+        ref = str(row['ref']) if row.get('ref') is not None else None
+
+        if row.get('type') == 'farmer':
+            self.farmers.append((ref, {'name': required(row, 'name')}))
+            self.buffered += 1
+        elif row.get('type') == 'forest':
+            self.forests.append((ref, {
+                'name': required(row, 'name'),
+                'location': required(row, 'location'),
+                **coordinates(row)
+            }))
+            self.buffered += 1
+        elif row.get('type') == 'tree':
+            quantity = to_int(row, 'quantity', 1)
+            limit = MAX_PLANTING_QUANTITY if self.storage == 'plantings' \
+                else MAX_IMPORT_QUANTITY
+            if not 1 <= quantity <= limit:
+                raise InvalidRow(f'quantity must be between 1 and {limit}')
+            self.trees.append((
+                line,
+                required(row, 'name'),
+                self.reference(row, 'farmer'),
+                self.reference(row, 'forest'),
+                quantity))
+            # a planting is a single row whatever its quantity
+            self.buffered += 1 if self.storage == 'plantings' else quantity
+        else:
+            raise InvalidRow('type must be farmer, forest or tree')
+
+    def add(self, line, row, bytes_read):
+        try:
+            self.parse(line, row)
+        except InvalidRow as e:
+            self.fail(line, str(e))
+        # a large quantity of trees takes several chunks
+        while self.buffered >= self.chunk_size:
+            self.flush(bytes_read)
+
+    def load_ids(self, model, ids):
+        # checks which of the referenced ids exist, one query per batch
+        ids = list(set(ids) - self.known_ids[model])
+        for start in range(0, len(ids), ID_BATCH_SIZE):
+            self.known_ids[model].update(
+                id for id, in db.session.query(model.id).filter(
+                    model.id.in_(ids[start:start + ID_BATCH_SIZE])))
+
+    def resolve(self, model, reference):
+        kind, value = reference
+        if kind == 'ref':
+            if value not in self.refs[model]:
+                raise InvalidRow(f'unknown {model.__tablename__[:-1]} '
+                                 f'ref {value}')
+            return self.refs[model][value]
+        if kind == 'id' and value not in self.known_ids[model]:
+            raise InvalidRow(f'{model.__tablename__[:-1]} {value} '
+                             'does not exist')
+        return value
+
+    def flush(self, bytes_read):
+        # loads the buffered rows in one transaction with the progress. At
+        # most chunk_size trees are written, the rest of a tree row is kept
+        # for the next chunk
+        remaining = []
+        try:
+            # the new species are committed on their own, before this
+            # transaction starts writing
+            species_cache.resolve(tree[1] for tree in self.trees)
+
+            imported = 0
+            for model, rows in ((Farmer, self.farmers),
+                                (Forest, self.forests)):
+                ids = model.insert_many([values for ref, values in rows])
+                for (ref, values), id in zip(rows, ids):
+                    if ref is not None:
+                        self.refs[model][ref] = id
+                imported += len(ids)
+
+            for model, position in ((Farmer, 2), (Forest, 3)):
+                self.load_ids(model, [
+                    tree[position][1] for tree in self.trees
+                    if tree[position][0] == 'id'])
+
+            rows = []
+            room = self.chunk_size
+            for line, name, farmer, forest, quantity in self.trees:
+                try:
+                    row = {
+                        'name': name,
+                        'farmer_id': self.resolve(Farmer, farmer),
+                        'forest_id': self.resolve(Forest, forest)
+                    }
+                except InvalidRow as e:
+                    self.fail(line, str(e))
+                    continue
+                if self.storage == 'plantings':
+                    rows.append(dict(row, quantity=quantity))
+                    continue
+                count = min(quantity, room)
+                rows.extend(dict(row) for i in range(count))
+                room -= count
+                if count < quantity:
+                    # the rest is not checked again
+                    remaining.append((
+                        line, name, ('resolved', row['farmer_id']),
+                        ('resolved', row['forest_id']), quantity - count))
+            if self.storage == 'plantings':
+                Planting.insert_many(rows)
+                imported += sum(row['quantity'] for row in rows)
+            else:
+                imported += len(Tree.insert_many(rows))
+
+            self.job.rows_imported += imported
+            self.job.rows_failed += self.failed
+            self.job.bytes_read = bytes_read
+            self.job.errors = json.dumps(self.errors)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        finally:
+            self.farmers, self.forests, self.trees = [], [], remaining
+            self.buffered = sum(tree[4] for tree in remaining)
+            self.failed = 0
+
+
+def import_path(import_id, file_format):
+    return os.path.join(IMPORTS_DIR, f'{import_id}.{file_format}')
+
+
+def remove_file(path):
+    # the file of a stale import may be removed while it is still read
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def fail_stale_imports():
+    '''Marks the imports lost with their worker as failed and removes their
+    files, returns their number'''
+    jobs = Import.fail_stale(
+        datetime.utcnow() - timedelta(hours=IMPORT_STALE_AFTER))
+    for import_id, file_format in jobs:
+        remove_file(import_path(import_id, file_format))
+    return len(jobs)
+
+
+def run_import(app, import_id, path):
+    with app.app_context():
+        job = Import.query.get(import_id)
+        if job.status != 'queued':
+            # marked as failed while it waited for a thread of the pool
+            db.session.remove()
+            return
+        job.status = 'running'
+        job.started_at = datetime.utcnow()
+        job.update()
+        try:
+            with open(path, 'rb') as stream:
+                loader = ImportLoader(
+                    job, storage=app.config.get('TREE_STORAGE', TREE_STORAGE))
+                for line, row in read_rows(stream, job.file_format):
+                    loader.add(line, row, stream.tell())
+                loader.flush(job.size)
+            job.status = 'done'
+        except Exception as e:
+            app.logger.exception(f'Import {import_id} failed: {e}')
+            db.session.rollback()
+            job.status = 'failed'
+            errors = json.loads(job.errors) if job.errors else []
+            job.errors = json.dumps(errors + [{'line': None, 'error': str(e)}])
+        finally:
+            job.finished_at = datetime.utcnow()
+            job.update()
+            db.session.remove()
+            remove_file(path)
+
+
+class ImportQueue:
+    def __init__(self, workers=IMPORT_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def submit(self, app, import_id, path):
+        # the pool is started by the first import, after the worker forked
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='import')
+        self.executor.submit(run_import, app, import_id, path)
+
+
+import_queue = ImportQueue()
+
+
+def queue_import(stream, file_format):
+    '''Saves the uploaded file and queues its import, returns the job'''
+    job = Import(file_format=file_format)
+    job.insert()
+
+    os.makedirs(IMPORTS_DIR, exist_ok=True)
+    path = import_path(job.id, file_format)
+    with open(path, 'wb') as upload:
+        shutil.copyfileobj(stream, upload)
+    job.size = os.path.getsize(path)
+    job.update()
+
+    import_queue.submit(current_app._get_current_object(), job.id, path)
+    return job
@@ -1,8 +1,11 @@
+from datetime import datetime, timedelta
+
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from app import app
-from models import db
+from models import (db, Counter, TreeStat, Tree, IdempotencyKey,
+                    TREE_PURGE_AFTER)
 
 migrate = Migrate(app, db)
 manager = Manager(app)
@@ -10,5 +13,27 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def reconcile_counters():
+    """Rebuilds the total counters and tree statistics from the tables"""
+    totals = Counter.reconcile()
+    TreeStat.reconcile()
+    print(f'Reconciled {len(totals)} counters and the tree statistics')
+
+
+@manager.command
+def purge_idempotency_keys():
+    """Deletes the expired idempotency keys of the batch endpoints"""
+    print(f'Purged {IdempotencyKey.purge()} idempotency keys')
+
+
+@manager.command
+def purge_deleted_trees():
+    """Deletes the rows of the trees deleted more than TREE_PURGE_AFTER
+    hours ago, in chunks of TREE_PURGE_CHUNK_SIZE rows"""
+    purged = Tree.purge(datetime.utcnow() - timedelta(hours=TREE_PURGE_AFTER))
+    print(f'Purged {purged} deleted trees')
+
+
 if __name__ == '__main__':
     manager.run()
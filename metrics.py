@@ -0,0 +1,204 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request, has_request_context, abort, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+Instrumentation
+Each worker records, per endpoint:
+- the request latency
+- the number of database queries of a request and the time spent in them,
+  measured around every statement of every engine
+- the time spent verifying tokens and encoding json bodies
+
+GET /metrics exposes them in the Prometheus text format, with the token cache
+counters, to the requests bearing METRICS_TOKEN when it is set. Statements
+slower than SLOW_QUERY_MS are logged with their SQL to the tree_app.sql
+logger, and every response carries a Server-Timing header with its database
+and total time.
+'''
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true') == 'true'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+slow_query_log = logging.getLogger('tree_app.sql')
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts, total = self.series.get(
+                labels, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.series[labels] = (counts, total + value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = [(labels, list(counts), total)
+                      for labels, (counts, total) in self.series.items()]
+        for labels, counts, total in sorted(series):
+            pairs = [f'{name}="{value}"'
+                     for name, value in zip(self.labels, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = ','.join(pairs + [f'le="{bound}"'])
+                lines.append(f'{self.name}_bucket{{{le}}} {cumulative}')
+            suffix = '{' + ','.join(pairs) + '}' if pairs else ''
+            lines.append(f'{self.name}_sum{suffix} {total}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+        return lines
+
+
+class Value:
+    def __init__(self, name, help, type='counter', read=None):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.value = 0
+        self.read = read
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def render(self):
+        value = self.read() if self.read is not None else self.value
+        return [f'# HELP {self.name} {self.help}',
+                f'# TYPE {self.name} {self.type}',
+                f'{self.name} {value}']
+
+
+request_latency = Histogram(
+    'http_request_duration_seconds', 'Latency of the requests',
+    ('endpoint', 'method', 'status'))
+request_queries = Histogram(
+    'db_queries_per_request', 'Database queries run by a request',
+    ('endpoint',), QUERY_COUNT_BUCKETS)
+request_db_time = Histogram(
+    'db_time_per_request_seconds', 'Time a request spent in the database',
+    ('endpoint',))
+jwt_verify_time = Histogram(
+    'jwt_verify_duration_seconds', 'Time spent verifying a token')
+serialization_time = Histogram(
+    'json_serialization_duration_seconds', 'Time spent encoding a json body',
+    ('endpoint',))
+slow_queries = Value('db_slow_queries_total',
+                     f'Statements slower than {SLOW_QUERY_MS:g}ms')
+
+
+def endpoint():
+    if not has_request_context():
+        return 'background'
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def observe_jwt_verify(seconds):
+    jwt_verify_time.observe(seconds)
+
+
+def observe_serialization(seconds):
+    if has_request_context():
+        serialization_time.observe(seconds, endpoint())
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_time += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc()
+        slow_query_log.warning(
+            'Slow query (%.1fms) in %s: %s', elapsed * 1000,
+            endpoint(), statement)
+
+
+def handle_error(context):
+    # a failed statement does not reach after_cursor_execute, its start is
+    # dropped so the pooled connection does not keep it
+    started = context.connection.info.get('query_started') \
+        if context.connection is not None else None
+    if started and context.execution_context is not None:
+        started.pop()
+
+
+class Metrics:
+    def __init__(self, enabled=METRICS_ENABLED, token=METRICS_TOKEN):
+        self.enabled = enabled
+        self.token = token
+        self.metrics = [request_latency, request_queries, request_db_time,
+                        jwt_verify_time, serialization_time, slow_queries]
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        # the listeners time the statements of every engine, replicas included
+        for listener in (before_cursor_execute, after_cursor_execute,
+                         handle_error):
+            if not event.contains(Engine, listener.__name__, listener):
+                event.listen(Engine, listener.__name__, listener)
+        if not slow_query_log.handlers:
+            slow_query_log.addHandler(logging.StreamHandler())
+        app.before_request(self.start_request)
+        app.after_request(self.record_request)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+
+    def add(self, metric):
+        self.metrics.append(metric)
+
+    def start_request(self):
+        g.request_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_time = 0
+
+    def record_request(self, response):
+        if 'request_started' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_started
+        name = endpoint()
+        request_latency.observe(elapsed, name, request.method,
+                                str(response.status_code))
+        request_queries.observe(g.db_queries, name)
+        request_db_time.observe(g.db_time, name)
+        response.headers['Server-Timing'] = (
+            f'db;dur={g.db_time * 1000:.1f};desc="{g.db_queries} queries", '
+            f'total;dur={elapsed * 1000:.1f}')
+        return response
+
+    def render(self):
+        if self.token and request.headers.get(
+                'Authorization') != f'Bearer {self.token}':
+            abort(401)
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return Response('\n'.join(lines) + '\n',
+                        mimetype='text/plain; version=0.0.4')
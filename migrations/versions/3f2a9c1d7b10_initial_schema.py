@@ -0,0 +1,56 @@
+"""initial schema
+
+The tables of the app before the migrations existed.
+
+Revision ID: 3f2a9c1d7b10
+Revises: 
+Create Date: 2026-10-18 09:12:41.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the tables the app created itself before the migrations existed are
+    # kept, so the first upgrade of such a database needs no stamp
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('farmers'):
+        op.create_table(
+            'farmers',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if not inspector.has_table('forests'):
+        op.create_table(
+            'forests',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('location', sa.String(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if not inspector.has_table('trees'):
+        op.create_table(
+            'trees',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('farmer_id', sa.Integer(), nullable=True),
+            sa.Column('forest_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['farmer_id'], ['farmers.id'], ),
+            sa.ForeignKeyConstraint(['forest_id'], ['forests.id'], ),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('trees')
+    op.drop_table('forests')
+    op.drop_table('farmers')
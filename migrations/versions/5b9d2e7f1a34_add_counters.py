@@ -0,0 +1,72 @@
+"""add counters
+
+Revision ID: 5b9d2e7f1a34
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-18 09:26:18.302915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9d2e7f1a34'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+# the counters and statistics of the trees already planted, as rebuilt by
+# python manage.py reconcile_counters. The colons of the keys that could be
+# read as bind parameters are escaped
+RECONCILE = (
+    "INSERT INTO counters (key, value) "
+    "SELECT 'farmers', count(*) FROM farmers",
+    "INSERT INTO counters (key, value) "
+    "SELECT 'forests', count(*) FROM forests",
+    "INSERT INTO counters (key, value) "
+    "SELECT 'trees', count(*) FROM trees",
+    "INSERT INTO counters (key, value) "
+    "SELECT 'forest:' || CAST(forest_id AS VARCHAR) || '\\:trees', "
+    "count(*) FROM trees WHERE forest_id IS NOT NULL GROUP BY forest_id",
+    "INSERT INTO counters (key, value) "
+    "SELECT 'farmer:' || CAST(farmer_id AS VARCHAR) || '\\:trees', "
+    "count(*) FROM trees WHERE farmer_id IS NOT NULL GROUP BY farmer_id",
+    "INSERT INTO tree_stats (forest_id, farmer_id, name, count) "
+    "SELECT COALESCE(forest_id, 0), COALESCE(farmer_id, 0), "
+    "COALESCE(name, ''), count(*) FROM trees "
+    "GROUP BY COALESCE(forest_id, 0), COALESCE(farmer_id, 0), "
+    "COALESCE(name, '')",
+)
+
+
+def upgrade():
+    # the tables may already exist if the app created them itself, their
+    # counts are then kept as they are
+    if sa.inspect(op.get_bind()).has_table('counters'):
+        return
+    op.create_table(
+        'counters',
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('key')
+    )
+    op.create_table(
+        'tree_stats',
+        sa.Column('forest_id', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('farmer_id', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('forest_id', 'farmer_id', 'name')
+    )
+    op.create_index('ix_tree_stats_farmer_id_name', 'tree_stats',
+                    ['farmer_id', 'name'], unique=False)
+    for statement in RECONCILE:
+        op.execute(statement)
+
+
+def downgrade():
+    op.drop_index('ix_tree_stats_farmer_id_name', table_name='tree_stats')
+    op.drop_table('tree_stats')
+    op.drop_table('counters')
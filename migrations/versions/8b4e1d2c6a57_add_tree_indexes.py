@@ -0,0 +1,42 @@
+"""add tree indexes
+
+Revision ID: 8b4e1d2c6a57
+Revises: 5b9d2e7f1a34
+Create Date: 2026-10-18 09:40:07.204817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e1d2c6a57'
+down_revision = '5b9d2e7f1a34'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_trees_forest_id_name': 'forest_id, name',
+    'ix_trees_farmer_id_name': 'farmer_id, name',
+    'ix_trees_forest_id_farmer_id': 'forest_id, farmer_id',
+}
+
+
+def upgrade():
+    # on PostgreSQL the indexes are built concurrently, outside of the
+    # migration transaction, so planting is not blocked on large tables.
+    # They may already exist if the app created the tables itself
+    concurrently = 'CONCURRENTLY ' \
+        if op.get_bind().dialect.name == 'postgresql' else ''
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.execute(f'CREATE INDEX {concurrently}IF NOT EXISTS {name} '
+                       f'ON trees ({columns})')
+
+
+def downgrade():
+    concurrently = 'CONCURRENTLY ' \
+        if op.get_bind().dialect.name == 'postgresql' else ''
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.execute(f'DROP INDEX {concurrently}IF EXISTS {name}')
@@ -0,0 +1,99 @@
+"""add species
+
+Revision ID: a7c3e5f19d24
+Revises: f41c6a8d2b95
+Create Date: 2026-10-18 18:12:46.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e5f19d24'
+down_revision = 'f41c6a8d2b95'
+branch_labels = None
+depends_on = None
+
+
+def create_tree_stats(key):
+    op.create_table(
+        'tree_stats',
+        sa.Column('forest_id', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('farmer_id', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        key,
+        sa.Column('count', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('forest_id', 'farmer_id', key.name)
+    )
+    op.create_index(f'ix_tree_stats_farmer_id_{key.name}', 'tree_stats',
+                    ['farmer_id', key.name], unique=False)
+
+
+def upgrade():
+    op.create_table(
+        'species',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.add_column('trees', sa.Column('species_id', sa.Integer()))
+
+    # every distinct tree name becomes a species
+    op.execute('INSERT INTO species (name) SELECT DISTINCT name FROM trees '
+               'WHERE name IS NOT NULL ORDER BY name')
+    op.execute('UPDATE trees SET species_id = (SELECT species.id FROM species '
+               'WHERE species.name = trees.name) WHERE name IS NOT NULL')
+
+    # the statistics are keyed by the species id, 0 for a missing species
+    op.drop_index('ix_tree_stats_farmer_id_name', table_name='tree_stats')
+    op.rename_table('tree_stats', 'tree_stats_by_name')
+    create_tree_stats(sa.Column('species_id', sa.Integer(),
+                                autoincrement=False, nullable=False))
+    op.execute('INSERT INTO tree_stats (forest_id, farmer_id, species_id, '
+               'count) SELECT s.forest_id, s.farmer_id, '
+               'COALESCE(species.id, 0), s.count FROM tree_stats_by_name s '
+               'LEFT JOIN species ON species.name = s.name')
+    op.drop_table('tree_stats_by_name')
+
+    op.drop_index('ix_trees_forest_id_name', table_name='trees')
+    op.drop_index('ix_trees_farmer_id_name', table_name='trees')
+    with op.batch_alter_table('trees') as batch_op:
+        batch_op.create_foreign_key('fk_trees_species_id_species', 'species',
+                                    ['species_id'], ['id'])
+        batch_op.drop_column('name')
+    op.create_index('ix_trees_forest_id_species_id', 'trees',
+                    ['forest_id', 'species_id'], unique=False)
+    op.create_index('ix_trees_farmer_id_species_id', 'trees',
+                    ['farmer_id', 'species_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_trees_forest_id_species_id', table_name='trees')
+    op.drop_index('ix_trees_farmer_id_species_id', table_name='trees')
+    op.add_column('trees', sa.Column('name', sa.String()))
+    op.execute('UPDATE trees SET name = (SELECT species.name FROM species '
+               'WHERE species.id = trees.species_id) '
+               'WHERE species_id IS NOT NULL')
+    op.create_index('ix_trees_forest_id_name', 'trees',
+                    ['forest_id', 'name'], unique=False)
+    op.create_index('ix_trees_farmer_id_name', 'trees',
+                    ['farmer_id', 'name'], unique=False)
+
+    op.drop_index('ix_tree_stats_farmer_id_species_id',
+                  table_name='tree_stats')
+    op.rename_table('tree_stats', 'tree_stats_by_species')
+    create_tree_stats(sa.Column('name', sa.String(), nullable=False))
+    op.execute("INSERT INTO tree_stats (forest_id, farmer_id, name, count) "
+               "SELECT s.forest_id, s.farmer_id, COALESCE(species.name, ''), "
+               "s.count FROM tree_stats_by_species s "
+               "LEFT JOIN species ON species.id = s.species_id")
+    op.drop_table('tree_stats_by_species')
+
+    with op.batch_alter_table('trees') as batch_op:
+        batch_op.drop_constraint('fk_trees_species_id_species',
+                                 type_='foreignkey')
+        batch_op.drop_column('species_id')
+    op.drop_table('species')
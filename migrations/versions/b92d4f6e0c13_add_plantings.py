@@ -0,0 +1,43 @@
+"""add plantings
+
+Revision ID: b92d4f6e0c13
+Revises: a7c3e5f19d24
+Create Date: 2026-10-18 19:03:27.640915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b92d4f6e0c13'
+down_revision = 'a7c3e5f19d24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'plantings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('species_id', sa.Integer(), nullable=True),
+        sa.Column('farmer_id', sa.Integer(), nullable=True),
+        sa.Column('forest_id', sa.Integer(), nullable=True),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('materialized', sa.Integer(), nullable=False),
+        sa.Column('planted_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['farmer_id'], ['farmers.id'], ),
+        sa.ForeignKeyConstraint(['forest_id'], ['forests.id'], ),
+        sa.ForeignKeyConstraint(['species_id'], ['species.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_plantings_forest_id_id', 'plantings',
+                    ['forest_id', 'id'], unique=False)
+    op.create_index('ix_plantings_farmer_id_id', 'plantings',
+                    ['farmer_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_plantings_farmer_id_id', table_name='plantings')
+    op.drop_index('ix_plantings_forest_id_id', table_name='plantings')
+    op.drop_table('plantings')
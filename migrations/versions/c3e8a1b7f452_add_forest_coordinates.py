@@ -0,0 +1,55 @@
+"""add forest coordinates
+
+Revision ID: c3e8a1b7f452
+Revises: b92d4f6e0c13
+Create Date: 2026-10-18 20:21:09.372518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8a1b7f452'
+down_revision = 'b92d4f6e0c13'
+branch_labels = None
+depends_on = None
+
+POINT = 'ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)'
+# the bounding box search uses the geometry index, the nearest forest
+# search the geography one, whose distances are in meters on the sphere
+INDEXES = {
+    'ix_forests_point': f'({POINT})',
+    'ix_forests_geography': f'(({POINT})::geography)',
+}
+
+
+def postgis_available():
+    bind = op.get_bind()
+    return bind.dialect.name == 'postgresql' and bind.execute(sa.text(
+        "SELECT count(*) FROM pg_available_extensions "
+        "WHERE name = 'postgis'")).scalar() > 0
+
+
+def upgrade():
+    op.add_column('forests', sa.Column('latitude', sa.Float()))
+    op.add_column('forests', sa.Column('longitude', sa.Float()))
+
+    # without PostGIS the app searches an in-memory grid instead
+    if not postgis_available():
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS postgis')
+    with op.get_context().autocommit_block():
+        for name, expression in INDEXES.items():
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} '
+                       f'ON forests USING gist {expression}')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name in INDEXES:
+                op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    with op.batch_alter_table('forests') as batch_op:
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
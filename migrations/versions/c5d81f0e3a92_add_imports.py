@@ -0,0 +1,42 @@
+"""add imports
+
+Revision ID: c5d81f0e3a92
+Revises: 8b4e1d2c6a57
+Create Date: 2026-10-18 11:02:53.770162
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d81f0e3a92'
+down_revision = '8b4e1d2c6a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the table already exists if it was created by db.create_all, which
+    # the app ran on start up before the migrations were used
+    if sa.inspect(op.get_bind()).has_table('imports'):
+        return
+    op.create_table(
+        'imports',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('file_format', sa.String(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('bytes_read', sa.BigInteger(), nullable=False),
+        sa.Column('rows_imported', sa.BigInteger(), nullable=False),
+        sa.Column('rows_failed', sa.BigInteger(), nullable=False),
+        sa.Column('errors', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('imports')
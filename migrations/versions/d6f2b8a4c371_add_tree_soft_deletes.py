@@ -0,0 +1,65 @@
+"""add tree soft deletes
+
+Revision ID: d6f2b8a4c371
+Revises: c3e8a1b7f452
+Create Date: 2026-10-18 22:05:37.814290
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6f2b8a4c371'
+down_revision = 'c3e8a1b7f452'
+branch_labels = None
+depends_on = None
+
+# the keyset indexes of the trees of a forest or farmer only hold the live
+# trees, and the purge index only the deleted ones
+INDEXES = {
+    'ix_trees_live_forest_id_id': '(forest_id, id) WHERE deleted_at IS NULL',
+    'ix_trees_live_farmer_id_id': '(farmer_id, id) WHERE deleted_at IS NULL',
+    'ix_trees_deleted_at': '(deleted_at) WHERE deleted_at IS NOT NULL',
+}
+# the indexes of every tree they replace
+REPLACED = {
+    'ix_trees_forest_id_id': '(forest_id, id)',
+    'ix_trees_farmer_id_id': '(farmer_id, id)',
+}
+
+
+def create_indexes(indexes, concurrently):
+    for name, definition in indexes.items():
+        op.execute(f'CREATE INDEX {concurrently}IF NOT EXISTS {name} '
+                   f'ON trees {definition}')
+
+
+def drop_indexes(indexes, concurrently):
+    for name in indexes:
+        op.execute(f'DROP INDEX {concurrently}IF EXISTS {name}')
+
+
+def upgrade():
+    # a nullable column without default does not rewrite the table
+    op.add_column('trees', sa.Column('deleted_at', sa.DateTime()))
+
+    # the new indexes are built before the ones they replace are dropped,
+    # so the pages of trees are never read without an index
+    concurrently = 'CONCURRENTLY ' \
+        if op.get_bind().dialect.name == 'postgresql' else ''
+    with op.get_context().autocommit_block():
+        create_indexes(INDEXES, concurrently)
+        drop_indexes(REPLACED, concurrently)
+
+
+def downgrade():
+    concurrently = 'CONCURRENTLY ' \
+        if op.get_bind().dialect.name == 'postgresql' else ''
+    with op.get_context().autocommit_block():
+        create_indexes(REPLACED, concurrently)
+        drop_indexes(INDEXES, concurrently)
+    # the deleted trees were uncounted, they are removed with the flag
+    op.execute('DELETE FROM trees WHERE deleted_at IS NOT NULL')
+    with op.batch_alter_table('trees') as batch_op:
+        batch_op.drop_column('deleted_at')
@@ -0,0 +1,39 @@
+"""add tree keyset indexes
+
+Revision ID: e2a7b9c4f813
+Revises: c5d81f0e3a92
+Create Date: 2026-10-18 16:40:12.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7b9c4f813'
+down_revision = 'c5d81f0e3a92'
+branch_labels = None
+depends_on = None
+
+# the trees of a forest or farmer are paged by id
+INDEXES = {
+    'ix_trees_forest_id_id': 'forest_id, id',
+    'ix_trees_farmer_id_id': 'farmer_id, id',
+}
+
+
+def upgrade():
+    concurrently = 'CONCURRENTLY ' \
+        if op.get_bind().dialect.name == 'postgresql' else ''
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.execute(f'CREATE INDEX {concurrently}IF NOT EXISTS {name} '
+                       f'ON trees ({columns})')
+
+
+def downgrade():
+    concurrently = 'CONCURRENTLY ' \
+        if op.get_bind().dialect.name == 'postgresql' else ''
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.execute(f'DROP INDEX {concurrently}IF EXISTS {name}')
@@ -0,0 +1,32 @@
+"""add idempotency keys
+
+Revision ID: f41c6a8d2b95
+Revises: e2a7b9c4f813
+Create Date: 2026-10-18 17:05:31.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f41c6a8d2b95'
+down_revision = 'e2a7b9c4f813'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('scope', sa.String(), nullable=False),
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('request_hash', sa.String(), nullable=False),
+        sa.Column('response', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('scope', 'key')
+    )
+
+
+def downgrade():
+    op.drop_table('idempotency_keys')
@@ -1,41 +1,670 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import (Column, String, Integer, BigInteger, Float, DateTime,
+                        Text, text,
+                        Index, create_engine, insert, update, delete, select,
+                        exists, and_, func, union_all)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy import orm, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm.attributes import get_history
+from flask import has_request_context
 from flask_sqlalchemy import SQLAlchemy
 import json
+import threading
+import time
+from datetime import datetime, timedelta
 
-database_path = os.environ.get("DATABASE_URL")
-if database_path.startswith("postgres://"):
-    database_path = database_path.replace("postgres://", "postgresql://", 1)
+from routing import RoutingSession, database_url
 
-db = SQLAlchemy()
+database_path = database_url(os.environ.get("DATABASE_URL"))
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        # GET requests can be routed to a read replica, see routing.py
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+BULK_INSERT_CHUNK_SIZE = 1000
+
+# hours a batch response is replayed for a retry with its Idempotency-Key
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24))
+
+# 'trees' stores one row per planted tree, 'plantings' one row per planting
+# of any quantity, the tree rows being created on demand
+TREE_STORAGE = os.environ.get('TREE_STORAGE', 'trees')
+TREE_STORAGES = ('trees', 'plantings')
+# the largest quantity of a planting row
+MAX_PLANTING_QUANTITY = 2 ** 31 - 1
+
+# hours a deleted tree is kept before being purged, and number of trees the
+# purge deletes per transaction
+TREE_PURGE_AFTER = int(os.environ.get('TREE_PURGE_AFTER', 24))
+TREE_PURGE_CHUNK_SIZE = int(os.environ.get('TREE_PURGE_CHUNK_SIZE', 5000))
+
+# seconds a worker trusts that a farmer or forest id it has seen still exists
+KNOWN_IDS_TTL = int(os.environ.get('KNOWN_IDS_TTL', 60))
+KNOWN_IDS_SIZE = 10000
+
+# milliseconds a statement of a web request may run on PostgreSQL, 0 for no
+# limit. The migrations, the manage.py commands and the imports run without it
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+
+
+def engine_options(database_path):
+    # connection pool settings, shared by the threads of a worker
+    options = {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true') == 'true',
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    database_path = database_path or ''
+    if not database_path.startswith('sqlite'):
+        options['pool_size'] = int(os.environ.get('DB_POOL_SIZE', 5))
+        options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+        options['pool_timeout'] = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    return options
+
+
+def set_statement_timeout(conn):
+    # SET LOCAL ends with the transaction, so the pooled connections do not
+    # keep the timeout once they are used outside of a request. The cursor of
+    # the driver opens the transaction the session then uses
+    if has_request_context() and conn.dialect.name == 'postgresql':
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(
+                f'SET LOCAL statement_timeout = {DB_STATEMENT_TIMEOUT_MS}')
+        finally:
+            cursor.close()
 
 
 def setup_db(app, database_path):
+    # the engine connects on the first query, the schema is created and
+    # upgraded by the migrations (python manage.py db upgrade)
+    if not database_path:
+        app.logger.warning(
+            'DATABASE_URL is not set, the database requests will fail')
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
+    if DB_STATEMENT_TIMEOUT_MS and \
+            not event.contains(Engine, 'begin', set_statement_timeout):
+        event.listen(Engine, 'begin', set_statement_timeout)
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+
+def upsert_increment(model, keys, column, delta):
+    # adds delta to the column of the row identified by keys, creating the
+    # row if needed, inside the current transaction
+    table = model.__table__
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        dialect_insert = postgresql.insert if dialect == 'postgresql' \
+            else sqlite.insert
+        statement = dialect_insert(table).values(**keys, **{column: delta})
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + delta}))
+        return
+
+    result = db.session.execute(update(table).where(and_(
+        *[table.c[key] == value for key, value in keys.items()]
+    )).values({column: table.c[column] + delta}))
+    if result.rowcount == 0:
+        db.session.execute(insert(table).values(**keys, **{column: delta}))
+
+
+def forest_trees_key(forest_id):
+    return f'forest:{forest_id}:trees'
+
+
+def farmer_trees_key(farmer_id):
+    return f'farmer:{farmer_id}:trees'
+
+
+def insert_rows(model, rows):
+    # inserts the rows in the current transaction, using multi-row
+    # INSERT ... RETURNING when the database supports it, and returns the
+    # ids of the new rows in the same order
+    returning = db.engine.dialect.full_returning
+    ids = []
+    for start in range(0, len(rows), BULK_INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + BULK_INSERT_CHUNK_SIZE]
+        if returning:
+            result = db.session.execute(
+                insert(model).values(chunk).returning(model.id))
+            ids.extend(result.scalars())
+        else:
+            for values in chunk:
+                result = db.session.execute(insert(model).values(values))
+                ids.append(result.inserted_primary_key[0])
+    return ids
+
+
+def version_key(table):
+    return f'version:{table}'
+
+
+def touch(*tables):
+    # bumps the version of the tables, read by the response cache
+    for table in tables:
+        Counter.increment(version_key(table))
+
+
+def count_trees(farmer_id, forest_id, species_id, delta):
+    # keeps the tree counters and statistics in step with a write, in the
+    # same transaction
+    Counter.increment('trees', delta)
+    if forest_id is not None:
+        Counter.increment(forest_trees_key(forest_id), delta)
+    if farmer_id is not None:
+        Counter.increment(farmer_trees_key(farmer_id), delta)
+    TreeStat.increment(farmer_id, forest_id, species_id, delta)
+
+
+class Counter(db.Model):
+    __tablename__ = "counters"
+
+    key = Column(String, primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def increment(cls, key, delta=1):
+        upsert_increment(cls, {'key': key}, 'value', delta)
+
+    @classmethod
+    def get(cls, key):
+        return db.session.query(cls.value).filter(
+            cls.key == key).scalar() or 0
+
+    @classmethod
+    def get_many(cls, keys):
+        values = dict(db.session.query(cls.key, cls.value).filter(
+            cls.key.in_(keys)))
+        return {key: values.get(key, 0) for key in keys}
+
+    @classmethod
+    def reconcile(cls):
+        # rebuilds every counter from the tables, returns the new values
+        totals = {
+            'farmers': db.session.query(func.count(Farmer.id)).scalar(),
+            'forests': db.session.query(func.count(Forest.id)).scalar(),
+            # the trees of the plantings that were not materialized count too
+            'trees': db.session.query(func.count(Tree.id)).filter(
+                Tree.live).scalar() + int(
+                db.session.query(func.sum(Planting.pending)).scalar() or 0)
+        }
+        for count, column, key, live in (
+                (func.count(Tree.id), Tree.forest_id, forest_trees_key,
+                 Tree.live),
+                (func.count(Tree.id), Tree.farmer_id, farmer_trees_key,
+                 Tree.live),
+                (func.sum(Planting.pending), Planting.forest_id,
+                 forest_trees_key, True),
+                (func.sum(Planting.pending), Planting.farmer_id,
+                 farmer_trees_key, True)):
+            for id, value in db.session.query(column, count).filter(
+                    column.isnot(None), live).group_by(column):
+                totals[key(id)] = totals.get(key(id), 0) + int(value or 0)
+
+        try:
+            # the table versions only ever grow, they are kept
+            db.session.query(cls).filter(
+                ~cls.key.like(version_key('%'))).delete(
+                synchronize_session=False)
+            db.session.add_all(
+                [cls(key=key, value=value) for key, value in totals.items()])
+            touch('farmers', 'forests', 'trees')
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        return totals
+
+
+class TreeStat(db.Model):
+    # number of trees of each species planted by a farmer in a forest, kept
+    # up to date by the tree writes. Missing ids are stored as 0, so they
+    # can be part of the key
+    __tablename__ = "tree_stats"
+    __table_args__ = (Index('ix_tree_stats_farmer_id_species_id',
+                            'farmer_id', 'species_id'),)
+
+    forest_id = Column(Integer, primary_key=True, autoincrement=False)
+    farmer_id = Column(Integer, primary_key=True, autoincrement=False)
+    species_id = Column(Integer, primary_key=True, autoincrement=False)
+    count = Column(BigInteger, nullable=False, default=0)
+
+    @classmethod
+    def increment(cls, farmer_id, forest_id, species_id, delta=1):
+        upsert_increment(cls, {
+            'forest_id': forest_id or 0,
+            'farmer_id': farmer_id or 0,
+            'species_id': species_id or 0
+        }, 'count', delta)
+
+    @classmethod
+    def by_forest(cls, forest_id):
+        # (farmer id, species name, count) rows
+        return [(farmer_id, species_cache.name(species_id), count)
+                for farmer_id, species_id, count in db.session.query(
+                    cls.farmer_id, cls.species_id, cls.count).filter(
+                    cls.forest_id == forest_id, cls.count > 0)]
+
+    @classmethod
+    def by_farmer(cls, farmer_id):
+        # (forest id, species name, count) rows
+        return [(forest_id, species_cache.name(species_id), count)
+                for forest_id, species_id, count in db.session.query(
+                    cls.forest_id, cls.species_id, cls.count).filter(
+                    cls.farmer_id == farmer_id, cls.count > 0)]
+
+    @classmethod
+    def aggregate(cls, group_by, filters, limit=None, descending=True):
+        # sums the statistics grouped by any of name, forest_id, farmer_id
+        # and the forest location, largest groups first
+        columns = {
+            'name': cls.species_id,
+            'forest_id': cls.forest_id,
+            'farmer_id': cls.farmer_id,
+            'location': Forest.location
+        }
+        unknown = [key for key in list(group_by) + list(filters)
+                   if key not in columns]
+        if unknown:
+            raise ValueError(
+                f'Unknown tree stats fields: {", ".join(unknown)}')
+
+        count = func.sum(cls.count).label('count')
+        query = db.session.query(
+            *[columns[key].label(key) for key in group_by], count).filter(
+            cls.count > 0)
+        if 'location' in group_by or 'location' in filters:
+            query = query.join(Forest, Forest.id == cls.forest_id)
+        for key, value in filters.items():
+            if key == 'name':
+                # an unknown species matches no statistics
+                value = species_cache.id(value) or -1
+            query = query.filter(columns[key] == value)
+        query = query.group_by(*[columns[key] for key in group_by]).order_by(
+            count.desc() if descending else count.asc(),
+            *[columns[key] for key in group_by])
+        if limit:
+            query = query.limit(limit)
+
+        # the missing ids stored in the key are returned as null, the species
+        # by name
+        stats = []
+        for row in query:
+            stat = {key: value or None if key != 'count' else int(value or 0)
+                    for key, value in row._asdict().items()}
+            if 'name' in stat:
+                stat['name'] = species_cache.name(stat['name'])
+            stats.append(stat)
+        return stats
+
+    @classmethod
+    def reconcile(cls):
+        # rebuilds the statistics from the trees and the trees of the
+        # plantings that were not materialized
+        counts = []
+        for model, count, live in (
+                (Tree, func.count(Tree.id), Tree.live),
+                (Planting, func.sum(Planting.pending), True)):
+            keys = [func.coalesce(getattr(model, key), 0).label(key)
+                    for key in ('forest_id', 'farmer_id', 'species_id')]
+            counts.append(select(*keys, count.label('count')).where(
+                live).group_by(*keys))
+        counts = union_all(*counts).subquery()
+        keys = (counts.c.forest_id, counts.c.farmer_id, counts.c.species_id)
+        try:
+            db.session.query(cls).delete()
+            db.session.execute(insert(cls).from_select(
+                ['forest_id', 'farmer_id', 'species_id', 'count'],
+                select(*keys, func.sum(counts.c.count)).group_by(*keys)))
+            touch('trees')
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+
+
+class ReferenceCache:
+    # ids of farmers and forests known to exist, so planting does not check
+    # them on every request. A delete in this worker drops the id at once,
+    # one in another worker once the entry expires, the foreign keys still
+    # reject the insert in between
+    def __init__(self, ttl=KNOWN_IDS_TTL, maxsize=KNOWN_IDS_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        expires_at = self.entries.get(key)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def add(self, model, id):
+        with self.lock:
+            if len(self.entries) >= self.maxsize:
+                self.entries.clear()
+            self.entries[(model.__tablename__, id)] = \
+                time.monotonic() + self.ttl
+
+    def discard(self, model, id):
+        with self.lock:
+            self.entries.pop((model.__tablename__, id), None)
+
+
+reference_cache = ReferenceCache()
+
+
+class Species(db.Model):
+    # the tree species, each tree references one by its id instead of
+    # repeating the name
+    __tablename__ = "species"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+
+
+class SpeciesCache:
+    # species names by id and ids by name. Species are never renamed or
+    # deleted, so the entries never go stale, and an unknown id or name
+    # reloads the table, which another worker may have added to
+    def __init__(self):
+        self.names = {}
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        # read from the primary, a replica may not have the new species yet
+        with db.engine.connect() as connection:
+            rows = connection.execute(select(Species.id, Species.name)).all()
+        with self.lock:
+            self.names = {id: name for id, name in rows}
+            self.ids = {name: id for id, name in rows}
+
+    def name(self, id):
+        if not id:
+            return None
+        if id not in self.names:
+            self.load()
+        return self.names.get(id)
+
+    def id(self, name):
+        if name is None:
+            return None
+        if name not in self.ids:
+            self.load()
+        return self.ids.get(name)
+
+    def resolve(self, names):
+        '''Returns the ids of the names by name, creating the missing
+        species'''
+        names = {name for name in names if name is not None}
+        if names - self.ids.keys():
+            self.load()
+        missing = names - self.ids.keys()
+        if missing:
+            self.create(missing)
+            self.load()
+        return {name: self.ids[name] for name in names}
+
+    def create(self, names):
+        # the species are committed on their own, before the write that
+        # needs them, so the cache never holds an id that was rolled back
+        table = Species.__table__
+        dialect = db.engine.dialect.name
+        for name in sorted(names):
+            if dialect in ('postgresql', 'sqlite'):
+                dialect_insert = postgresql.insert \
+                    if dialect == 'postgresql' else sqlite.insert
+                statement = dialect_insert(table).values(
+                    name=name).on_conflict_do_nothing(index_elements=['name'])
+                with db.engine.begin() as connection:
+                    connection.execute(statement)
+                continue
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(insert(table).values(name=name))
+            except IntegrityError:
+                # created by another worker in between
+                pass
+
+
+species_cache = SpeciesCache()
 
 
 class Tree(db.Model):
     __tablename__ = "trees"
+    __table_args__ = (
+        Index('ix_trees_forest_id_species_id', 'forest_id', 'species_id'),
+        Index('ix_trees_farmer_id_species_id', 'farmer_id', 'species_id'),
+        Index('ix_trees_forest_id_farmer_id', 'forest_id', 'farmer_id'),
+        # the trees of a forest or farmer are paged by id among the live
+        # ones, the purge reads the deleted ones
+        Index('ix_trees_live_forest_id_id', 'forest_id', 'id',
+              postgresql_where=text('deleted_at IS NULL'),
+              sqlite_where=text('deleted_at IS NULL')),
+        Index('ix_trees_live_farmer_id_id', 'farmer_id', 'id',
+              postgresql_where=text('deleted_at IS NULL'),
+              sqlite_where=text('deleted_at IS NULL')),
+        Index('ix_trees_deleted_at', 'deleted_at',
+              postgresql_where=text('deleted_at IS NOT NULL'),
+              sqlite_where=text('deleted_at IS NOT NULL')),
+    )
 
     id = Column(Integer, primary_key=True)
-    name = Column(String)
+    species_id = Column(Integer, db.ForeignKey('species.id'))
     farmer_id = Column(Integer, db.ForeignKey('farmers.id'))
     forest_id = Column(Integer, db.ForeignKey('forests.id'))
+    # a deleted tree is hidden from every read until it is purged
+    deleted_at = Column(DateTime)
+
+    # fields that can be requested through the ?fields= projection, the
+    # name is the one of the species
+    fields = ('id', 'name', 'farmer_id', 'forest_id')
+
+    @property
+    def name(self):
+        return species_cache.name(self.species_id)
+
+    @name.setter
+    def name(self, name):
+        self.species_id = species_cache.resolve([name]).get(name)
+
+    @classmethod
+    def column(cls, field):
+        if field == 'name':
+            return cls.species_id.label('name')
+        return getattr(cls, field)
+
+    @classmethod
+    def columns(cls, fields=None):
+        # the id is always selected, it is the pagination cursor
+        if not fields:
+            return [cls.column(field) for field in cls.fields]
+        unknown = [field for field in fields if field not in cls.fields]
+        if unknown:
+            raise ValueError(f'Unknown tree fields: {", ".join(unknown)}')
+        return [cls.id] + [cls.column(field)
+                           for field in cls.fields
+                           if field in fields and field != 'id']
+
+    @staticmethod
+    def to_dict(row):
+        # a row of the columns above, the species id of its name is replaced
+        # by the species name
+        values = row._asdict()
+        if 'name' in values:
+            values['name'] = species_cache.name(values['name'])
+        return values
+
+    @hybrid_property
+    def live(self):
+        return self.deleted_at is None
+
+    @live.expression
+    def live(cls):
+        return cls.deleted_at.is_(None)
+
+    @classmethod
+    def page(cls, columns, *criteria, after=0, limit=100):
+        '''Returns the rows of the live trees matching the criteria after the
+        cursor, as dicts of the columns, and the cursor of the next page'''
+        # fetching one extra row tells us if there is a next page
+        rows = db.session.query(*columns).filter(
+            cls.id > after, cls.live, *criteria).order_by(cls.id).limit(
+            limit + 1).all()
+        next_cursor = rows[limit - 1].id if len(rows) > limit else None
+        return [cls.to_dict(row) for row in rows[:limit]], next_cursor
 
     def insert(self):
         db.session.add(self)
+        count_trees(self.farmer_id, self.forest_id, self.species_id, 1)
+        touch('trees')
         db.session.commit()
 
+    @staticmethod
+    def missing_references(farmer_id, forest_id):
+        # returns the names of the references that do not exist, checking
+        # the ids that are not cached in a single query
+        missing = []
+        checks = []
+        for name, model, id in (('farmer', Farmer, farmer_id),
+                                ('forest', Forest, forest_id)):
+            if (model.__tablename__, id) not in reference_cache:
+                checks.append((name, model, id))
+
+        if checks:
+            found = db.session.query(*[
+                exists().where(model.id == id)
+                for name, model, id in checks]).one()
+            for (name, model, id), exist in zip(checks, found):
+                if exist:
+                    reference_cache.add(model, id)
+                else:
+                    missing.append(name)
+        return missing
+
+    @classmethod
+    def insert_many(cls, rows):
+        # inserts the trees, given with the name of their species, and
+        # updates their counters without committing, returns the ids of the
+        # new trees
+        if not rows:
+            return []
+        species = species_cache.resolve(row.get('name') for row in rows)
+        rows = [{
+            'species_id': species.get(row.get('name')),
+            'farmer_id': row.get('farmer_id'),
+            'forest_id': row.get('forest_id')
+        } for row in rows]
+        ids = insert_rows(cls, rows)
+        planted = {}
+        for row in rows:
+            key = (row['farmer_id'], row['forest_id'], row['species_id'])
+            planted[key] = planted.get(key, 0) + 1
+        for (farmer_id, forest_id, species_id), count in planted.items():
+            count_trees(farmer_id, forest_id, species_id, count)
+        touch('trees')
+        return ids
+
+    @classmethod
+    def plant(cls, name, farmer_id, forest_id, quantity):
+        # inserts quantity identical trees in a single transaction and
+        # returns the ids of the new trees
+        row = {'name': name, 'farmer_id': farmer_id, 'forest_id': forest_id}
+        try:
+            ids = cls.insert_many([dict(row) for i in range(quantity)])
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        return sorted(ids)
+
     def update(self):
+        # moving a tree to another farmer, forest or species moves its
+        # count too
+        changes = {key: get_history(self, key)
+                   for key in ('farmer_id', 'forest_id', 'species_id')}
+        if any(history.has_changes() for history in changes.values()):
+            count_trees(*[
+                (history.deleted or [None])[0] if history.has_changes()
+                else getattr(self, key)
+                for key, history in changes.items()], -1)
+            count_trees(self.farmer_id, self.forest_id, self.species_id, 1)
+        touch('trees')
         db.session.commit()
 
     def delete(self):
-        db.session.delete(self)
-        db.session.commit()
+        # returns False when a concurrent request deleted the tree first
+        return Tree.delete_many(Tree.id == self.id) == 1
+
+    @classmethod
+    def delete_many(cls, *criteria):
+        '''Soft deletes the live trees matching the criteria in a single
+        update and returns their number'''
+        # the update only marks the trees that are still live, so a tree
+        # deleted by concurrent requests is uncounted once. The counters,
+        # which every planting writes too, are decremented last so they stay
+        # locked briefly
+        deleted_at = datetime.utcnow()
+        statement = update(cls.__table__).where(cls.live, *criteria).values(
+            deleted_at=deleted_at)
+        keys = ('farmer_id', 'forest_id', 'species_id')
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                # the deleted rows are counted by the database, from the
+                # update itself
+                deleted = statement.returning(
+                    *[cls.__table__.c[key] for key in keys]).cte('deleted')
+                groups = db.session.execute(select(
+                    *[deleted.c[key] for key in keys], func.count()).group_by(
+                    *[deleted.c[key] for key in keys])).all()
+            elif db.session.execute(statement).rowcount:
+                # the update holds the database write lock, the rows it
+                # marked are counted before any other write
+                groups = db.session.query(
+                    *[getattr(cls, key) for key in keys], func.count()).filter(
+                    cls.deleted_at == deleted_at, *criteria).group_by(
+                    *[getattr(cls, key) for key in keys]).all()
+            else:
+                groups = []
+            for farmer_id, forest_id, species_id, count in groups:
+                count_trees(farmer_id, forest_id, species_id, -count)
+            touch('trees')
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        return sum(count for *key, count in groups)
+
+    @classmethod
+    def purge(cls, before, chunk_size=TREE_PURGE_CHUNK_SIZE):
+        '''Deletes the rows of the trees deleted before the date, chunk_size
+        rows per transaction, and returns their number'''
+        # the deleted trees were uncounted already
+        purged = 0
+        while True:
+            chunk = select(cls.id).where(cls.deleted_at < before).limit(
+                chunk_size).scalar_subquery()
+            try:
+                count = db.session.execute(delete(cls.__table__).where(
+                    cls.id.in_(chunk))).rowcount
+                db.session.commit()
+            except BaseException:
+                db.session.rollback()
+                raise
+            purged += count
+            if count < chunk_size:
+                return purged
 
     def format(self):
         return {
@@ -46,39 +675,197 @@ class Tree(db.Model):
         }
 
 
+class Planting(db.Model):
+    # a number of trees of one species planted by a farmer in a forest,
+    # stored as a single row. The planted trees are counted in the counters
+    # and statistics as soon as the planting is recorded, the individual
+    # tree rows are only created when materialized
+    __tablename__ = "plantings"
+    __table_args__ = (
+        Index('ix_plantings_forest_id_id', 'forest_id', 'id'),
+        Index('ix_plantings_farmer_id_id', 'farmer_id', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    species_id = Column(Integer, db.ForeignKey('species.id'))
+    farmer_id = Column(Integer, db.ForeignKey('farmers.id'))
+    forest_id = Column(Integer, db.ForeignKey('forests.id'))
+    quantity = Column(Integer, nullable=False)
+    materialized = Column(Integer, nullable=False, default=0)
+    planted_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    @hybrid_property
+    def pending(self):
+        # the trees that have no tree row yet
+        return self.quantity - self.materialized
+
+    @property
+    def name(self):
+        return species_cache.name(self.species_id)
+
+    @classmethod
+    def page(cls, *criteria, after=0, limit=100):
+        '''Returns the plantings matching the criteria after the cursor and
+        the cursor of the next page'''
+        plantings = cls.query.filter(cls.id > after, *criteria).order_by(
+            cls.id).limit(limit + 1).all()
+        next_cursor = plantings[limit - 1].id \
+            if len(plantings) > limit else None
+        return [planting.format() for planting in plantings[:limit]], \
+            next_cursor
+
+    @classmethod
+    def insert_many(cls, rows):
+        # inserts the plantings, given with the name of their species, and
+        # counts their trees without committing, returns their ids
+        if not rows:
+            return []
+        species = species_cache.resolve(row.get('name') for row in rows)
+        rows = [{
+            'species_id': species.get(row.get('name')),
+            'farmer_id': row.get('farmer_id'),
+            'forest_id': row.get('forest_id'),
+            'quantity': row['quantity'],
+            'materialized': 0
+        } for row in rows]
+        ids = insert_rows(cls, rows)
+        planted = {}
+        for row in rows:
+            key = (row['farmer_id'], row['forest_id'], row['species_id'])
+            planted[key] = planted.get(key, 0) + row['quantity']
+        for (farmer_id, forest_id, species_id), count in planted.items():
+            count_trees(farmer_id, forest_id, species_id, count)
+        touch('trees')
+        return ids
+
+    @classmethod
+    def plant(cls, name, farmer_id, forest_id, quantity):
+        # records the planting in a single row and returns it
+        try:
+            id, = cls.insert_many([{
+                'name': name,
+                'farmer_id': farmer_id,
+                'forest_id': forest_id,
+                'quantity': quantity
+            }])
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        return cls.query.get(id)
+
+    def materialize(self, quantity=None):
+        # creates the tree rows of up to quantity pending trees, all of them
+        # by default, and returns their ids. The trees were counted when the
+        # planting was recorded, so the counters do not change
+        quantity = self.pending if quantity is None \
+            else min(quantity, self.pending)
+        row = {
+            'species_id': self.species_id,
+            'farmer_id': self.farmer_id,
+            'forest_id': self.forest_id
+        }
+        try:
+            ids = insert_rows(Tree, [dict(row) for i in range(quantity)])
+            self.materialized += quantity
+            touch('trees')
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        return sorted(ids)
+
+    def format(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'farmer_id': self.farmer_id,
+            'forest_id': self.forest_id,
+            'quantity': self.quantity,
+            'materialized': self.materialized,
+            'planted_at': self.planted_at.isoformat()
+        }
+
+
 class Forest(db.Model):
     __tablename__ = "forests"
 
     id = Column(Integer, primary_key=True)
     name = Column(String)
     location = Column(String)
+    # optional coordinates, searched through geo.py
+    latitude = Column(Float)
+    longitude = Column(Float)
+
+    fields = ('id', 'name', 'location', 'latitude', 'longitude')
 
+    # the trees and plantings are detached and deleted in bulk by delete(),
+    # never loaded one by one
     trees = db.relationship(
         'Tree',
         backref=db.backref('forests'),
         lazy=True,
-        cascade='delete')
+        passive_deletes='all')
+    plantings = db.relationship('Planting', lazy=True, passive_deletes='all')
 
     def insert(self):
         db.session.add(self)
+        Counter.increment('forests')
+        touch('forests')
         db.session.commit()
 
+    @classmethod
+    def insert_many(cls, rows):
+        # inserts the forests without committing, returns their ids
+        if not rows:
+            return []
+        ids = insert_rows(cls, rows)
+        Counter.increment('forests', len(ids))
+        touch('forests')
+        return ids
+
     def update(self):
+        touch('forests')
         db.session.commit()
 
     def delete(self):
+        # the trees of the forest are deleted with it, in a single update
+        # that soft deletes them and detaches the ones already deleted, the
+        # purge removes the rows
+        db.session.execute(update(Tree.__table__).where(
+            Tree.forest_id == self.id).values(
+            forest_id=None,
+            deleted_at=func.coalesce(Tree.deleted_at, datetime.utcnow())))
+        Planting.query.filter(Planting.forest_id == self.id).delete(
+            synchronize_session=False)
+        for farmer_id, name, count in TreeStat.by_forest(self.id):
+            Counter.increment('trees', -count)
+            if farmer_id:
+                Counter.increment(farmer_trees_key(farmer_id), -count)
+        TreeStat.query.filter(TreeStat.forest_id == self.id).delete()
+        Counter.query.filter(
+            Counter.key == forest_trees_key(self.id)).delete()
+        Counter.increment('forests', -1)
+        touch('forests', 'trees')
         db.session.delete(self)
         db.session.commit()
+        reference_cache.discard(Forest, self.id)
 
     def format(self):
         return {
             'id': self.id,
             'name': self.name,
             'location': self.location,
+            'latitude': self.latitude,
+            'longitude': self.longitude
         }
 
     def get_trees(self):
-        return [tree.format() for tree in self.trees]
+        # one query on the selected columns, the relationship would load
+        # every tree as a model instance
+        return [Tree.to_dict(row) for row in db.session.query(
+            *Tree.columns()).filter(Tree.forest_id == self.id,
+                                    Tree.live).order_by(Tree.id)]
 
 
 class Farmer(db.Model):
@@ -87,18 +874,40 @@ class Farmer(db.Model):
     id = Column(Integer, primary_key=True)
     name = Column(String)
 
+    fields = ('id', 'name')
+
     trees = db.relationship('Tree', backref=db.backref('farmers'), lazy=True)
+    plantings = db.relationship('Planting', lazy=True)
 
     def insert(self):
         db.session.add(self)
+        Counter.increment('farmers')
+        touch('farmers')
         db.session.commit()
 
+    @classmethod
+    def insert_many(cls, rows):
+        # inserts the farmers without committing, returns their ids
+        if not rows:
+            return []
+        ids = insert_rows(cls, rows)
+        Counter.increment('farmers', len(ids))
+        touch('farmers')
+        return ids
+
     def update(self):
+        touch('farmers')
         db.session.commit()
 
     def delete(self):
+        TreeStat.query.filter(TreeStat.farmer_id == self.id).delete()
+        Counter.query.filter(
+            Counter.key == farmer_trees_key(self.id)).delete()
+        Counter.increment('farmers', -1)
+        touch('farmers')
         db.session.delete(self)
         db.session.commit()
+        reference_cache.discard(Farmer, self.id)
 
     def format(self):
         return {
@@ -107,4 +916,114 @@ class Farmer(db.Model):
         }
 
     def get_trees(self):
-        return [tree.format() for tree in self.trees]
+        return [Tree.to_dict(row) for row in db.session.query(
+            *Tree.columns()).filter(Tree.farmer_id == self.id,
+                                    Tree.live).order_by(Tree.id)]
+
+
+class Import(db.Model):
+    # a bulk import of farmers, forests and trees, loaded in the background
+    __tablename__ = "imports"
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False, default='queued')
+    file_format = Column(String, nullable=False)
+    size = Column(BigInteger, nullable=False, default=0)
+    bytes_read = Column(BigInteger, nullable=False, default=0)
+    rows_imported = Column(BigInteger, nullable=False, default=0)
+    rows_failed = Column(BigInteger, nullable=False, default=0)
+    errors = Column(Text)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def update(self):
+        db.session.commit()
+
+    @classmethod
+    def fail_stale(cls, before):
+        '''Marks the jobs queued or running since before the date as failed,
+        their worker having stopped without finishing them, and returns their
+        ids and formats'''
+        table = cls.__table__
+        stale = and_(table.c.status.in_(('queued', 'running')),
+                     func.coalesce(table.c.started_at,
+                                   table.c.created_at) < before)
+        # written on the primary, the request may read from a replica
+        with db.engine.begin() as connection:
+            jobs = connection.execute(select(
+                table.c.id, table.c.file_format, table.c.errors).where(
+                stale)).all()
+            for job in jobs:
+                errors = json.loads(job.errors) if job.errors else []
+                errors.append({'line': None,
+                               'error': 'The import was interrupted'})
+                connection.execute(update(table).where(
+                    table.c.id == job.id, stale).values(
+                    status='failed', finished_at=datetime.utcnow(),
+                    errors=json.dumps(errors)))
+        return [(job.id, job.file_format) for job in jobs]
+
+    def format(self):
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = ((self.finished_at or datetime.utcnow()) -
+                       self.started_at).total_seconds()
+        return {
+            'id': self.id,
+            'status': self.status,
+            'format': self.file_format,
+            'progress': round(self.bytes_read / self.size, 4)
+            if self.size else 0,
+            'rows_imported': self.rows_imported,
+            'rows_failed': self.rows_failed,
+            'rows_per_second': round(self.rows_imported / elapsed, 1)
+            if elapsed else 0,
+            'errors': json.loads(self.errors) if self.errors else [],
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat()
+            if self.started_at else None,
+            'finished_at': self.finished_at.isoformat()
+            if self.finished_at else None
+        }
+
+
+class IdempotencyKey(db.Model):
+    # the response of a batch write, replayed instead of writing again when
+    # the client retries the request with the same Idempotency-Key header
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    @classmethod
+    def find(cls, scope, key):
+        # an expired key is dropped, the request then runs again
+        stored = cls.query.get((scope, key))
+        if stored is not None and stored.created_at < \
+                datetime.utcnow() - timedelta(hours=IDEMPOTENCY_KEY_TTL):
+            cls.query.filter(cls.scope == scope, cls.key == key).delete()
+            return None
+        return stored
+
+    @classmethod
+    def add(cls, scope, key, request_hash, response):
+        # stored in the transaction of the write, without committing
+        db.session.add(cls(scope=scope, key=key, request_hash=request_hash,
+                           response=json.dumps(response)))
+
+    @classmethod
+    def purge(cls):
+        # deletes the expired keys, returns their number
+        expired = cls.query.filter(cls.created_at < datetime.utcnow() -
+                                   timedelta(hours=IDEMPOTENCY_KEY_TTL))
+        count = expired.delete(synchronize_session=False)
+        db.session.commit()
+        return count
@@ -0,0 +1,163 @@
+import logging
+import os
+import threading
+import time
+
+from flask import g, request, has_app_context
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+'''
+Read replicas
+DATABASE_REPLICA_URLS lists read replicas of DATABASE_URL, comma separated.
+GET requests read from one of them, the other requests and the background
+jobs use the primary.
+
+- after a write the client keeps reading from the primary for
+  REPLICA_STICKY_SECONDS, through a cookie, so it sees its own writes
+- a replica lagging more than REPLICA_MAX_LAG_SECONDS behind the primary, or
+  failing, is skipped until its next check, REPLICA_CHECK_INTERVAL seconds
+  later. Without a healthy replica the reads go to the primary
+- the replicas are connected to with a timeout of REPLICA_CONNECT_TIMEOUT
+  seconds, and a single request checks a replica at a time, the others
+  using its last known health meanwhile
+'''
+
+REPLICA_URLS = os.environ.get('DATABASE_REPLICA_URLS', '')
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+REPLICA_CHECK_INTERVAL = float(os.environ.get('REPLICA_CHECK_INTERVAL', 1))
+REPLICA_CONNECT_TIMEOUT = int(os.environ.get('REPLICA_CONNECT_TIMEOUT', 2))
+STICKY_COOKIE = 'db_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+logger = logging.getLogger('tree_app.routing')
+
+# seconds since the last replayed transaction, 0 when the replica is caught
+# up with the primary or is not a replica
+LAG_QUERIES = {
+    'postgresql': (
+        "SELECT CASE "
+        "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+        "THEN 0 ELSE COALESCE(EXTRACT(EPOCH FROM "
+        "now() - pg_last_xact_replay_timestamp()), 0) END"),
+}
+
+
+def database_url(url):
+    # heroku still hands out postgres:// urls, which SQLAlchemy 1.4 refuses
+    if url and url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+
+def replica_url(url, connect_timeout=REPLICA_CONNECT_TIMEOUT):
+    # an unreachable replica fails its check after connect_timeout seconds
+    # instead of the TCP timeout of the system
+    url = make_url(database_url(url))
+    if url.get_backend_name() == 'postgresql' and \
+            'connect_timeout' not in url.query:
+        url = url.update_query_dict({'connect_timeout': str(connect_timeout)})
+    return url.render_as_string(hide_password=False)
+
+
+class RoutingSession(SignallingSession):
+    '''Sends the queries of a routed request to its replica'''
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = g.get('db_replica') if has_app_context() else None
+        # flushes only happen on writes, which always go to the primary
+        if replica is not None and not self._flushing:
+            return replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class ReplicaRouter:
+    def __init__(self, urls, sticky_seconds=REPLICA_STICKY_SECONDS,
+                 max_lag=REPLICA_MAX_LAG_SECONDS,
+                 check_interval=REPLICA_CHECK_INTERVAL):
+        self.binds = {f'replica_{i}': replica_url(url.strip())
+                      for i, url in enumerate(urls) if url.strip()}
+        self.sticky_seconds = sticky_seconds
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.health = {}
+        self.checking = set()
+        self.turn = 0
+        self.lock = threading.Lock()
+        self.app = None
+
+    @classmethod
+    def from_config(cls, config):
+        urls = config.get('DATABASE_REPLICA_URLS', REPLICA_URLS)
+        if isinstance(urls, str):
+            urls = urls.split(',')
+        return cls(urls)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['replica_router'] = self
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        app.config['SQLALCHEMY_BINDS'] = {**binds, **self.binds}
+        if self.binds:
+            app.before_request(self.route_request)
+            app.after_request(self.stick_to_primary)
+
+    def engine(self, name):
+        return get_state(self.app).db.get_engine(self.app, bind=name)
+
+    def lag(self, engine):
+        with engine.connect() as connection:
+            query = LAG_QUERIES.get(engine.dialect.name, 'SELECT 0')
+            return float(connection.execute(text(query)).scalar() or 0)
+
+    def healthy(self, name):
+        with self.lock:
+            healthy, checked_at = self.health.get(name, (False, 0))
+            # the check runs outside the lock, so a replica that does not
+            # answer only holds up the request checking it
+            if checked_at + self.check_interval > time.monotonic() or \
+                    name in self.checking:
+                return healthy
+            self.checking.add(name)
+        try:
+            healthy = self.lag(self.engine(name)) <= self.max_lag
+        except Exception as e:
+            logger.warning(f'Replica {name} is unavailable: {e}')
+            healthy = False
+        finally:
+            with self.lock:
+                self.health[name] = (healthy, time.monotonic())
+                self.checking.discard(name)
+        return healthy
+
+    def choose(self):
+        '''Returns the name of the next healthy replica, None if there is
+        none'''
+        names = list(self.binds)
+        turn = self.turn
+        for i in range(len(names)):
+            name = names[(turn + i) % len(names)]
+            if self.healthy(name):
+                self.turn = (turn + i + 1) % len(names)
+                return name
+        return None
+
+    def route_request(self):
+        if request.method not in READ_METHODS:
+            return
+        sticky_until = request.cookies.get(STICKY_COOKIE, 0, type=float)
+        if sticky_until > time.time():
+            return
+        name = self.choose()
+        if name is not None:
+            g.db_replica = self.engine(name)
+
+    def stick_to_primary(self, response):
+        if request.method not in READ_METHODS + ('OPTIONS',) and \
+                response.status_code < 400:
+            response.set_cookie(
+                STICKY_COOKIE, str(time.time() + self.sticky_seconds),
+                max_age=int(self.sticky_seconds) + 1, httponly=True)
+        return response
@@ -0,0 +1,79 @@
+import json
+import os
+import time
+
+from flask import Response
+
+from metrics import observe_serialization
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:
+    # Flask < 2.2 has no json providers, the endpoints call json_response
+    DefaultJSONProvider = None
+
+'''
+JSON serialization
+The list endpoints encode their bodies with dumps, backed by orjson when it
+is installed and by the standard json module otherwise. JSON_BACKEND forces
+one of them.
+'''
+
+
+def dumps_orjson(obj):
+    # None keys, as in the per species counts, are written as "null" like
+    # the json module does
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def dumps_json(obj):
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+
+BACKENDS = {'json': dumps_json}
+if orjson is not None:
+    BACKENDS['orjson'] = dumps_orjson
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def set_backend(name):
+    global JSON_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f'Unavailable json backend: {name}')
+    JSON_BACKEND = name
+
+
+def dumps(obj):
+    '''Encodes obj to json bytes with the configured backend'''
+    return BACKENDS[JSON_BACKEND](obj)
+
+
+set_backend(os.environ.get('JSON_BACKEND', JSON_BACKEND))
+
+
+def json_response(payload, status=200):
+    started = time.perf_counter()
+    body = dumps(payload)
+    observe_serialization(time.perf_counter() - started)
+    return Response(body, status=status, mimetype='application/json')
+
+
+if DefaultJSONProvider is not None:
+    class FastJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            return dumps(obj).decode()
+
+        def response(self, *args, **kwargs):
+            return json_response(self._prepare_response_obj(args, kwargs))
+
+
+def init_app(app):
+    # on Flask 2.2 and later jsonify goes through the same encoder
+    if DefaultJSONProvider is not None:
+        app.json = FastJSONProvider(app)
@@ -1,10 +1,19 @@
 import os
+import time
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import create_engine, text
 
 from app import create_app
-from models import setup_db, Tree, Forest, Farmer
+from auth import JWKSCache, TokenCache
+import serialization
+from models import setup_db, db, Tree, Forest, Farmer, Import
+from routing import STICKY_COOKIE
+from metrics import Histogram, Metrics
 
 # these variables will be used to test endpoints that require authorization
 ADMIN_TOKEN = os.environ['ADMIN_TOKEN']
@@ -53,10 +62,8 @@ class TreeAppTestCase(unittest.TestCase):
 
         # binds the app to the current context
         with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
+            # the app leaves the schema to the migrations
+            db.create_all()
 
     def tearDown(self):
         """Executed after reach test"""
@@ -70,6 +77,40 @@ class TreeAppTestCase(unittest.TestCase):
         self.assertEqual(data["success"], True)
         self.assertTrue(len(data["trees"]))
 
+    def test_get_trees_paginated(self):
+        res = self.client().get("/trees?limit=1&fields=name")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(len(data["trees"]), 1)
+        self.assertEqual(set(data["trees"][0]), {"id", "name"})
+        self.assertIn("next_cursor", data)
+
+    def test_get_trees_unknown_field(self):
+        res = self.client().get("/trees?fields=height")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+    def test_get_trees_bad_cursor(self):
+        for query in ("after=abc", "limit=abc"):
+            res = self.client().get(f"/trees?{query}")
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data["success"], False)
+
+    def test_export_trees_ndjson(self):
+        res = self.client().get("/trees?format=ndjson")
+        rows = [json.loads(line) for line in res.data.splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertTrue(len(rows))
+        self.assertTrue(rows[0]["id"])
+
     def test_get_forests(self):
         res = self.client().get("/forests")
         data = json.loads(res.data)
@@ -77,6 +118,47 @@ class TreeAppTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data["success"], True)
         self.assertTrue(len(data["forests"]))
+        self.assertEqual(set(data["forests"][0]),
+                         {"id", "name", "location", "latitude", "longitude"})
+
+    def test_search_forests(self):
+        res = self.client().post(
+            "/forests", json={"name": "Bosco", "location": "Torino",
+                              "latitude": 45.07, "longitude": 7.69},
+            headers=self.admin_headers)
+        id = json.loads(res.data)["created"]["id"]
+        res = self.client().get("/forests/search?min_lat=45&min_lon=7.6"
+                                "&max_lat=45.1&max_lon=7.7&limit=1000")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(id, [forest["id"] for forest in data["forests"]])
+
+    def test_nearest_forests(self):
+        res = self.client().post(
+            "/forests", json={"name": "Bosco", "location": "Torino",
+                              "latitude": 45.07, "longitude": 7.69},
+            headers=self.admin_headers)
+        res = self.client().get("/forests/nearest?lat=45.07&lon=7.69&k=1")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["forests"][0]["distance_km"], 0)
+
+    def test_nearest_forests_bad_request(self):
+        res = self.client().get("/forests/nearest?lat=95&lon=7.69")
+
+        self.assertEqual(res.status_code, 400)
+
+    def test_metrics(self):
+        res = self.client().get("/forests")
+        self.assertIn("db;dur=", res.headers["Server-Timing"])
+
+        res = self.client().get("/metrics")
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(
+            'http_request_duration_seconds_count{endpoint="/forests"',
+            res.data.decode())
 
     def test_get_farmers(self):
         res = self.client().get("/farmers")
@@ -112,6 +194,65 @@ class TreeAppTestCase(unittest.TestCase):
         self.assertTrue(data["trees"])
         self.assertTrue(data["number_of_trees"])
 
+    def test_get_one_forest_with_trees(self):
+        res = self.client().get("/forests/1?include=trees&limit=2")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["trees"])
+        self.assertTrue(len(data["tree_list"]) <= 2)
+        self.assertTrue(all(tree["forest_id"] == 1
+                            for tree in data["tree_list"]))
+        self.assertIn("next_cursor", data)
+
+    def test_get_one_forest_not_modified(self):
+        res = self.client().get("/forests/1")
+        etag = res.headers["ETag"]
+        res = self.client().get(
+            "/forests/1", headers={"If-None-Match": etag})
+
+        self.assertEqual(res.status_code, 304)
+
+    def test_get_one_forest_modified_after_planting(self):
+        res = self.client().get("/forests/1")
+        etag = res.headers["ETag"]
+        self.client().post("/trees", json=self.new_tree,
+                           headers=self.farmer_headers)
+        res = self.client().get(
+            "/forests/1", headers={"If-None-Match": etag})
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_get_tree_stats(self):
+        res = self.client().get("/stats/trees?group_by=name,forest_id&limit=5")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertLessEqual(len(data["stats"]), 5)
+        self.assertEqual(set(data["stats"][0]), {"name", "forest_id", "count"})
+
+    def test_get_tree_stats_unknown_group(self):
+        res = self.client().get("/stats/trees?group_by=height")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+    def test_get_tree_stats_bad_filter(self):
+        res = self.client().get("/stats/trees?forest_id=abc")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
+    def test_get_plantings_bad_filter(self):
+        res = self.client().get("/plantings?farmer_id=abc")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+
     def test_create_farmer(self):
         res = self.client().post(
             "/farmers",
@@ -124,6 +265,19 @@ class TreeAppTestCase(unittest.TestCase):
         self.assertTrue(data["created"])
         self.assertTrue(data["farmers"])
 
+    def test_create_farmer_increments_total(self):
+        first = json.loads(self.client().post(
+            "/farmers",
+            json=self.new_farmer,
+            headers=self.admin_headers).data)
+        second = json.loads(self.client().post(
+            "/farmers",
+            json=self.new_farmer,
+            headers=self.admin_headers).data)
+
+        self.assertEqual(second["total_farmers"],
+                         first["total_farmers"] + 1)
+
     def test_create_farmer_unauthorized(self):
         res = self.client().post(
             "/farmers",
@@ -134,6 +288,30 @@ class TreeAppTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 401)
         self.assertEqual(data["success"], False)
 
+    def test_create_farmers_batch(self):
+        res = self.client().post(
+            "/farmers/batch",
+            json={"farmers": [self.new_farmer, {"name": ""}]},
+            headers=self.admin_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["created"]), 1)
+        self.assertEqual(data["created"][0]["index"], 0)
+        self.assertEqual(data["failed"][0]["index"], 1)
+
+    def test_create_forests_batch_retry(self):
+        headers = dict(self.admin_headers,
+                       **{"Idempotency-Key": str(time.time())})
+        body = {"forests": [{"name": "Foresta", "location": "Angola"}]}
+        first = self.client().post("/forests/batch", json=body,
+                                   headers=headers)
+        retry = self.client().post("/forests/batch", json=body,
+                                   headers=headers)
+
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(json.loads(retry.data), json.loads(first.data))
+
     def test_patch_farmer(self):
         res = self.client().patch(
             "/farmers/1",
@@ -161,7 +339,8 @@ class TreeAppTestCase(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data["success"], True)
-        self.assertTrue(data["forests"])
+        self.assertTrue(data["created"])
+        self.assertTrue(data["total_forests"])
 
     def test_create_forest_unauthorized(self):
         res = self.client().post(
@@ -183,6 +362,99 @@ class TreeAppTestCase(unittest.TestCase):
         self.assertTrue(data["created"])
         self.assertTrue(data["total_trees"])
 
+    def test_create_tree_updates_forest_stats(self):
+        before = json.loads(self.client().get("/forests/1").data)
+        self.client().post("/trees", json=self.new_tree,
+                           headers=self.farmer_headers)
+        after = json.loads(self.client().get("/forests/1").data)
+
+        self.assertEqual(after["trees"]["Platano"],
+                         before["trees"].get("Platano", 0) + 5)
+        self.assertEqual(after["number_of_trees"],
+                         before["number_of_trees"] + 5)
+
+    def test_create_tree_new_species(self):
+        species = f'Species {time.time()}'
+        res = self.client().post("/trees?return=range",
+                                 json=dict(self.new_tree, name=species),
+                                 headers=self.farmer_headers)
+        first_id = json.loads(res.data)["created"]["ranges"][0][0]
+        res = self.client().get(f"/trees?after={first_id - 1}&limit=1")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["trees"][0]["name"], species)
+
+    def test_create_tree_as_planting(self):
+        app = create_app({'TREE_STORAGE': 'plantings',
+                          'RESPONSE_CACHE': 'none'})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+        before = json.loads(client.get("/forests/1").data)
+        trees_before = json.loads(client.get("/trees?limit=1000").data)
+        res = client.post("/trees", json=self.new_tree,
+                          headers=self.farmer_headers)
+        data = json.loads(res.data)
+        after = json.loads(client.get("/forests/1").data)
+        trees_after = json.loads(client.get("/trees?limit=1000").data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["planting"]["quantity"], 5)
+        self.assertEqual(data["planting"]["materialized"], 0)
+        self.assertEqual(after["number_of_trees"],
+                         before["number_of_trees"] + 5)
+        self.assertEqual(trees_after["number_of_trees"],
+                         trees_before["number_of_trees"])
+
+    def test_materialize_planting(self):
+        app = create_app({'TREE_STORAGE': 'plantings',
+                          'RESPONSE_CACHE': 'none'})
+        setup_db(app, self.database_path)
+        client = app.test_client()
+        planting = json.loads(client.post(
+            "/trees", json=self.new_tree,
+            headers=self.farmer_headers).data)["planting"]
+        before = json.loads(client.get("/forests/1").data)
+        res = client.post(f"/plantings/{planting['id']}/trees",
+                          json={"quantity": 2}, headers=self.farmer_headers)
+        data = json.loads(res.data)
+        after = json.loads(client.get("/forests/1").data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["created"]["quantity"], 2)
+        self.assertEqual(data["planting"]["materialized"], 2)
+        self.assertEqual(after["number_of_trees"], before["number_of_trees"])
+
+    def test_materialize_planting_404(self):
+        res = self.client().post("/plantings/424242/trees",
+                                 headers=self.farmer_headers)
+
+        self.assertEqual(res.status_code, 404)
+
+    def test_create_tree_id_range(self):
+        res = self.client().post("/trees?return=range", json=self.new_tree,
+                                 headers=self.farmer_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["created"]["quantity"], 5)
+        self.assertEqual(sum(last - first + 1 for first, last
+                             in data["created"]["ranges"]), 5)
+
+    def test_create_tree_unknown_forest(self):
+        before = json.loads(self.client().get("/forests/1").data)
+        res = self.client().post(
+            "/trees",
+            json=dict(self.new_tree, forest_id=4242),
+            headers=self.farmer_headers)
+        data = json.loads(res.data)
+        after = json.loads(self.client().get("/forests/1").data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(after["number_of_trees"], before["number_of_trees"])
+
     def test_create_tree_bad_request(self):
         res = self.client().post("/trees", headers=self.farmer_headers)
         data = json.loads(res.data)
@@ -190,6 +462,85 @@ class TreeAppTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 422)
         self.assertEqual(data["success"], False)
 
+    def test_create_tree_quantity_too_large(self):
+        for quantity in (True, 100000000):
+            res = self.client().post(
+                "/trees",
+                json=dict(self.new_tree, quantity=quantity),
+                headers=self.farmer_headers)
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(data["success"], False)
+
+    def test_create_tree_boolean_ids(self):
+        res = self.client().post(
+            "/trees",
+            json=dict(self.new_tree, farmer_id=True),
+            headers=self.farmer_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+        res = self.client().delete("/trees", json={"ids": [True]},
+                                   headers=self.admin_headers)
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_create_import(self):
+        rows = [
+            {"type": "farmer", "ref": "f", "name": "Imported Farmer"},
+            {"type": "forest", "ref": "w", "name": "Imported Forest",
+             "location": "Kenya"},
+            {"type": "tree", "name": "Moringa", "farmer_ref": "f",
+             "forest_ref": "w", "quantity": 10},
+        ]
+        res = self.client().post(
+            "/imports",
+            data="\n".join(json.dumps(row) for row in rows),
+            content_type="application/x-ndjson",
+            headers=self.admin_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["import"]["format"], "ndjson")
+
+        res = self.client().get(
+            res.headers["Location"], headers=self.admin_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(data["import"]["status"],
+                      ["queued", "running", "done"])
+
+    def test_get_import_stale(self):
+        # an import its worker stopped running is reported as failed
+        with self.app.app_context():
+            started_at = datetime.utcnow() - timedelta(days=1)
+            job = Import(file_format="csv", status="running",
+                         created_at=started_at, started_at=started_at)
+            job.insert()
+            job_id = job.id
+
+        res = self.client().get(f"/imports/{job_id}",
+                                headers=self.admin_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["import"]["status"], "failed")
+        self.assertTrue(data["import"]["errors"])
+
+    def test_create_import_unauthorized(self):
+        res = self.client().post(
+            "/imports",
+            data="",
+            content_type="application/x-ndjson",
+            headers=self.farmer_headers)
+
+        self.assertEqual(res.status_code, 401)
+
     def test_delete_tree(self):
         res = self.client().delete("/trees/1")
         data = json.loads(res.data)
@@ -206,6 +557,221 @@ class TreeAppTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data["success"], False)
 
+    def test_delete_trees(self):
+        res = self.client().post("/trees?return=range", json=self.new_tree,
+                                 headers=self.admin_headers)
+        created = json.loads(res.data)["created"]
+        ids = [id for first, last in created["ranges"]
+               for id in range(first, last + 1)]
+
+        res = self.client().delete("/trees", json={"ids": ids},
+                                   headers=self.admin_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertEqual(data["deleted"], len(ids))
+
+        # the deleted trees are no longer listed
+        res = self.client().get(f"/trees?after={ids[0] - 1}")
+        data = json.loads(res.data)
+        self.assertFalse(set(ids) & {tree["id"] for tree in data["trees"]})
+
+    def test_delete_trees_by_filter(self):
+        res = self.client().delete("/trees", json={
+            "forest_id": 1, "name": "Platano"}, headers=self.admin_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["success"], True)
+        self.assertIn("total_trees", data)
+
+    def test_delete_trees_422(self):
+        res = self.client().delete("/trees", json={},
+                                   headers=self.admin_headers)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+
+
+class JWKSCacheTestCase(unittest.TestCase):
+    """This class represents the signing keys cache test case"""
+
+    def setUp(self):
+        self.fetches = 0
+        self.kids = ['first']
+
+        def loader():
+            self.fetches += 1
+            return {'keys': [{'kid': kid} for kid in self.kids]}
+
+        self.cache = JWKSCache(loader=loader, ttl=3600,
+                               min_refresh_interval=0)
+
+    def test_keys_are_cached(self):
+        self.assertTrue(self.cache.get_key('first'))
+        self.assertTrue(self.cache.get_key('first'))
+        self.assertEqual(self.fetches, 1)
+
+    def test_unknown_kid_refetches(self):
+        self.cache.get_key('first')
+        self.kids.append('second')
+
+        self.assertTrue(self.cache.get_key('second'))
+        self.assertEqual(self.fetches, 2)
+
+    def test_unknown_kid_refetch_is_rate_limited(self):
+        self.cache.min_refresh_interval = 3600
+        self.cache.get_key('first')
+
+        self.assertIsNone(self.cache.get_key('second'))
+        self.assertEqual(self.fetches, 1)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    """This class represents the verified token cache test case"""
+
+    def setUp(self):
+        self.cache = TokenCache(maxsize=2)
+        self.payload = {'permissions': [], 'exp': time.time() + 60}
+
+    def test_cached_payload_is_returned(self):
+        self.cache.set('token', self.payload)
+
+        self.assertEqual(self.cache.get('token'), self.payload)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_expired_payload_is_dropped(self):
+        self.cache.set('token', {'permissions': [], 'exp': time.time() - 1})
+
+        self.assertIsNone(self.cache.get('token'))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.set('first', self.payload)
+        self.cache.set('second', self.payload)
+        self.cache.get('first')
+        self.cache.set('third', self.payload)
+
+        self.assertIsNone(self.cache.get('second'))
+        self.assertTrue(self.cache.get('first'))
+
+
+class SerializationTestCase(unittest.TestCase):
+    """This class represents the json backends test case"""
+
+    def test_backends_encode_the_same_document(self):
+        body = {'success': True, 'trees': {None: 2, 'Palm': 1},
+                'stats': [{'name': 'Oak', 'count': 3}]}
+        documents = [json.loads(encode(body))
+                     for encode in serialization.BACKENDS.values()]
+
+        self.assertTrue(all(document == documents[0]
+                            for document in documents))
+        self.assertEqual(documents[0]['trees'], {'null': 2, 'Palm': 1})
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            serialization.set_backend('simplejson')
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """This class represents the read replica routing test case"""
+
+    def setUp(self):
+        # a farmer only the replica has shows where a request was read from
+        self.replica_file = tempfile.NamedTemporaryFile(suffix='.db')
+        replica_url = f'sqlite:///{self.replica_file.name}'
+        replica = create_engine(replica_url)
+        db.metadata.create_all(replica)
+        with replica.begin() as connection:
+            connection.execute(db.metadata.tables['farmers'].insert(),
+                               {'id': 999999, 'name': 'Replica farmer'})
+        replica.dispose()
+
+        self.app = create_app({'DATABASE_REPLICA_URLS': replica_url,
+                               'RESPONSE_CACHE': 'none'})
+        with self.app.app_context():
+            db.create_all()
+        self.router = self.app.extensions['replica_router']
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.replica_file.close()
+
+    def test_get_reads_from_replica(self):
+        res = self.client.get('/farmers/999999')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['farmer']['name'],
+                         'Replica farmer')
+
+    def test_write_sticks_to_primary(self):
+        res = self.client.post('/farmers', json={'name': 'Gino Gianni'},
+                               headers={'Authorization': ADMIN_TOKEN})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(STICKY_COOKIE, res.headers.get('Set-Cookie'))
+        self.assertEqual(self.client.get('/farmers/999999').status_code, 404)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        self.router.lag = lambda engine: self.router.max_lag + 1
+
+        self.assertEqual(self.client.get('/farmers/999999').status_code, 404)
+
+    def test_hanging_replica_falls_back_to_primary(self):
+        # the other requests read from the primary while one request waits
+        # for the replica to answer its check
+        checking = threading.Event()
+        answer = threading.Event()
+
+        def lag(engine):
+            checking.set()
+            answer.wait(5)
+            return 0
+
+        self.router.lag = lag
+        check = threading.Thread(target=self.router.choose)
+        check.start()
+        checking.wait(5)
+        try:
+            self.assertEqual(
+                self.client.get('/farmers/999999').status_code, 404)
+        finally:
+            answer.set()
+            check.join()
+
+
+class QueryTimingTestCase(unittest.TestCase):
+    """This class represents the statement timing test case"""
+
+    def test_failed_statement_is_not_kept(self):
+        Metrics(enabled=True).init_app(Flask(__name__))
+        engine = create_engine('sqlite://')
+        with engine.connect() as connection:
+            for i in range(3):
+                with self.assertRaises(Exception):
+                    connection.execute(text('SELECT * FROM missing'))
+
+            self.assertEqual(connection.info['query_started'], [])
+
+
+class HistogramTestCase(unittest.TestCase):
+    """This class represents the metrics histogram test case"""
+
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram('latency', 'Latency', ('endpoint',), (1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value, '/trees')
+        lines = histogram.render()
+
+        self.assertIn('latency_bucket{endpoint="/trees",le="1"} 2', lines)
+        self.assertIn('latency_bucket{endpoint="/trees",le="2"} 3', lines)
+        self.assertIn('latency_bucket{endpoint="/trees",le="+Inf"} 4', lines)
+        self.assertIn('latency_count{endpoint="/trees"} 4', lines)
+
 
 # make the test conveniently executable
 if __name__ == "__main__":